@@ -1,92 +1,313 @@
+import concurrent.futures
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 __pows_of_85 = [1, 85, 7225, 614125, 52200625]
 
+# Maps each base 85 digit (0 - 84), or pair of digits (0 - 7224), into
+# its ASCII85 character(s), from "!" to "u".
+_digit_to_character = [bytes([33 + i]) for i in range(85)]
+_digit_pair_to_characters = [bytes([33 + i // 85, 33 + i % 85]) for i in range(85 * 85)]
+
+# Encodes data whose length is a multiple of 4, converting every 32-bit
+# word into its block at once.
+def _encode_words(byte_data: bytes):
+    if numpy is not None:
+        words = numpy.frombuffer(byte_data, dtype = ">u4").astype(numpy.uint32)
+        zero_words = (words == 0)
+
+        # Convert every word into 5 base 85 digits, from the least significant
+        # one to the most significant one, and then into ASCII characters
+        # between "!" and "u".
+        characters = numpy.empty((len(words), 5), dtype = numpy.uint8)
+
+        for j in range(4, -1, -1):
+            characters[:, j] = words % 85
+            words //= 85
+
+        characters += 33
+
+        if not zero_words.any():
+            return characters.tobytes()
+
+        # A zero-block would be represented by the 5-characters string "!!!!!",
+        # however, for the sake of compression, the "z" character is used
+        # instead. The other 4 characters are masked out.
+        characters[zero_words, 0] = 122 # ord("z")
+
+        kept_characters = numpy.ones(characters.shape, dtype = bool)
+        kept_characters[zero_words, 1 : ] = False
+
+        return characters[kept_characters].tobytes()
+
+    words = struct.unpack(">%dI" % (len(byte_data) // 4), byte_data)
+
+    # NOTE: 2^32 // 85^3 is less than 85^2, so the first two digits can be
+    # looked up at once, and so can the next two.
+    pairs = _digit_pair_to_characters
+    singles = _digit_to_character
+
+    blocks = [pairs[w // 614125] + pairs[(w // 85) % 7225] + singles[w % 85] for w in words]
+
+    if 0 not in words:
+        return b"".join(blocks)
+
+    # Zero-blocks ("!!!!!") are replaced by "z" all at once. Every block is
+    # preceded by a space (removed afterwards), so only whole blocks match.
+    return (b" " + b" ".join(blocks)).replace(b" !!!!!", b" z").translate(None, b" ")
+
 # Converts an ASCII-based bytestream into its ASCII85-based representation,
 # using Adobe's guidelines.
 def encode(byte_data: bytes):
+    # Any buffer (e.g. a "memoryview" or an "array") is encoded as its bytes.
+    byte_data = memoryview(byte_data).cast("B")
+
     # Calculate padding bytes required (must be a multiple of 4).
     padding = (-len(byte_data) % 4)
-
-    # Duplicate the data and add padding null-characters at the end. Duplication is
-    # implicit since "bytes" objects are immutable.
-    byte_data += b"\0" * padding
+    full_length = len(byte_data) - (len(byte_data) % 4)
 
     # Prepare the resulting buffer and add leading guard.
     byte_result = bytearray(b"<~")
 
-    # Loop through the data in blocks of 4 bytes.
-    for i in range(0, len(byte_data), 4):
-        # Convert the 4-byte block into a number. This *SHOULD* be 32 bits long if
-        # Python doesn't represent it differently.
-        numeric_block = int.from_bytes(byte_data[i : i + 4], "big")
-
-        if numeric_block != 0:
-            # Non-zero blocks are stored as 5 characters long strings.
-            for j in range(0, 5):
-                # Convert each byte in the numeric block into a base 84 digit.
-                base_84_digit = (numeric_block // __pows_of_85[4 - j]) % 85
-
-                # Convert said digit into an ASCII character ordinal between "!" and "u",
-                # and store it.
-                byte_result.append(base_84_digit + 33)
-        else:
-            # A zero-block would be represented by the 5-characters string "!!!!!",
-            # however, for the sake of compression, the "z" character is used instead.
-            byte_result.append(122) # ord("z")
-
-    # Ignore padding characters and add trailing guard.
-    byte_result = byte_result[0 : len(byte_result) - padding]
+    # Encode all complete blocks without copying them.
+    byte_result += _encode_words(byte_data[0 : full_length])
+
+    if padding != 0:
+        # Add padding null-characters to the last block. Even if it's zero,
+        # it's not stored as "z" since the padding characters are ignored.
+        numeric_block = int.from_bytes(bytes(byte_data[full_length : ]) + b"\0" * padding, "big")
+
+        for j in range(0, 5 - padding):
+            # Convert each byte in the numeric block into a base 85 digit.
+            base_85_digit = (numeric_block // __pows_of_85[4 - j]) % 85
+
+            # Convert said digit into an ASCII character ordinal between "!" and "u",
+            # and store it.
+            byte_result.append(base_85_digit + 33)
+
+    # Add trailing guard.
     byte_result += b"~>"
 
     return byte_result
 
+# Bytes which are not part of an ASCII85 block ("!" to "u", or "z") and
+# must therefore be ignored. Whitespace is the most common case.
+_ignored_characters = bytes(c for c in range(256) if not (33 <= c <= 117 or c == 122))
+
+# Maps each ASCII85 character ("!" to "u") into its base 85 digit (0 - 84).
+_character_to_digit = bytes((c - 33) % 256 for c in range(256))
+
+# Removes guards and ignored characters, and expands "z" characters into
+# their equivalent 5-character block, leaving only full-length blocks
+# (except, maybe, the last one).
+def _normalize(byte_data: bytes):
+    # Remove leading (<~) and trailing (~>) guards, if present.
+    start = 2 if byte_data[0 : 2] == b"<~" else 0
+    end = len(byte_data) - 2 if byte_data[-2 : ] == b"~>" else len(byte_data)
+
+    if start != 0 or end != len(byte_data):
+        byte_data = byte_data[start : end]
+
+    # NOTE: Both "translate" and "replace" work at C speed over the whole
+    # buffer, which is way faster than inspecting each character in Python.
+    byte_data = byte_data.translate(None, _ignored_characters)
+
+    # The "z" character was originally a 4 null characters block, which is
+    # what "!!!!!" decodes to.
+    if b"z" in byte_data:
+        byte_data = byte_data.replace(b"z", b"!!!!!")
+
+    return byte_data
+
+# Decodes normalized data whose length is a multiple of 5, converting
+# every block into its 32-bit word at once.
+def _decode_blocks(byte_data: bytes):
+    block_count = len(byte_data) // 5
+
+    if numpy is not None:
+        # Restore the original ASCII range (0 - 84 instead of 33 - 117) of
+        # every character, with one row per block.
+        digits = numpy.frombuffer(byte_data, dtype = numpy.uint8)
+        digits = digits.reshape(block_count, 5) - 33
+
+        # Undo base 85 conversion using Horner's method. 64-bit words are
+        # needed since "uuuuu" does not fit inside 32 bits.
+        words = digits[:, 0].astype(numpy.uint64)
+
+        for j in range(1, 5):
+            words *= 85
+            words += digits[:, j]
+
+        if block_count > 0 and words.max() > 0xFFFFFFFF:
+            raise ValueError("ASCII85 block does not fit inside 32 bits")
+
+        # Write the words straight into the result as big-endian integers.
+        byte_result = bytearray(block_count * 4)
+        numpy.frombuffer(byte_result, dtype = ">u4")[:] = words
+
+        return byte_result
+
+    digits = byte_data.translate(_character_to_digit)
+
+    # Group the digits in blocks of 5 without slicing the data.
+    blocks = zip(*([iter(digits)] * 5))
+    words = [(((a * 85 + b) * 85 + c) * 85 + d) * 85 + e for a, b, c, d, e in blocks]
+
+    try:
+        return bytearray(struct.pack(">%dI" % block_count, *words))
+    except struct.error:
+        raise ValueError("ASCII85 block does not fit inside 32 bits")
+
 # Converts an ASCII85-based bytestream into its ASCII representation, using
 # Adobe's guidelines.
 def decode(byte_data: bytes):
-    # TODO: See if this makes a copy, or simply moves a pointer ("bytes" objects are
-    # immutable).
-    # Remove leading (<~) and trailing (~>) guards.
-    byte_data = byte_data[2 : len(byte_data) - 2]
+    byte_data = _normalize(byte_data)
+
+    # Calculate padding bytes required (must be a multiple of 5).
+    padding = (-len(byte_data) % 5)
+
+    # Add padding "u" characters at the end, completing the last block.
+    if padding != 0:
+        byte_data += b"u" * padding
+
+    byte_result = _decode_blocks(byte_data)
+
+    # Trim padding characters in-place.
+    del byte_result[len(byte_result) - padding : ]
+
+    return byte_result
+
+# Inputs smaller than this (in bytes) are not worth sending to other
+# processes, and are decoded in the current one instead.
+parallel_threshold = 8 * 1024 * 1024
+
+# Same as "decode", but splits the data in several chunks which are decoded
+# by a pool of processes. The split happens once the data has been
+# normalized, at multiples of 5, so that no block is ever cut in half.
+def decode_parallel(byte_data: bytes, workers: int = None, threshold: int = None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if threshold is None:
+        threshold = parallel_threshold
+
+    if workers <= 1 or len(byte_data) < threshold:
+        return decode(byte_data)
+
+    byte_data = _normalize(byte_data)
 
     # Calculate padding bytes required (must be a multiple of 5).
     padding = (-len(byte_data) % 5)
 
-    # Duplicate the data and add padding "u" characters at the end. Duplication is
-    # implicit since "bytes" objects are immutable.
-    byte_data += b"u" * padding
+    if padding != 0:
+        byte_data += b"u" * padding
+
+    # Use a few chunks per worker so that a slow one doesn't hold the rest.
+    block_count = len(byte_data) // 5
+    chunk_length = -(-block_count // (workers * 4)) * 5
+    chunks = [byte_data[i : i + chunk_length] for i in range(0, len(byte_data), chunk_length)]
 
-    # Prepare the resulting buffer.
     byte_result = bytearray()
 
-    # Blocks are made of 5 non-consecutive, non-z and non-whitespace characters.
-    numeric_block = 0
-    numeric_block_length = 0
-
-    # Analyze each ASCII character.
-    for c in byte_data:
-        if c == ord("z"): # c == 122:
-            # The "z" character was originally a 4 null characters block.
-            byte_result.append(b"\0\0\0\0")
-        elif ord("!") <= c <= ord("u"): # 33 <= c <= 117:
-            # Restore the original ASCII range (0 - 84 instead of 33 - 117) by subtracting
-            # 33 and undo base 84 conversion using multiplication by a power of 85.
-            c -= 33
-            c *= __pows_of_85[4 - numeric_block_length]
-
-            # Re-encode the character inside a 32-bit integer.
-            numeric_block += c
-            numeric_block_length += 1
-
-            # The block is complete.
-            if numeric_block_length == 5:
-                # Split each byte from the 4 that make up the block.
-                byte_result += numeric_block.to_bytes(4, "big")
-
-                # Reset.
-                numeric_block = 0
-                numeric_block_length = 0
-        else:
-            # Other characters are ignored.
-            pass
-
-    # Trim padding characters.
-    return byte_result[0 : len(byte_result) - padding]
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        # NOTE: "map" returns the results in the same order as the chunks,
+        # regardless of which one finishes first.
+        for decoded_chunk in executor.map(_decode_blocks, chunks):
+            byte_result += decoded_chunk
+
+    # Trim padding characters in-place.
+    del byte_result[len(byte_result) - padding : ]
+
+    return byte_result
+
+# Decodes an ASCII85-based bytestream incrementally, one chunk at a time,
+# so that the whole input never has to be held in memory. Incomplete
+# blocks and guards are carried over from one chunk to the next.
+class Decoder:
+    def __init__(self):
+        # Start of the stream, kept until it's long enough to tell whether
+        # it begins with the leading guard (<~) or not.
+        self.head = bytearray()
+
+        # Normalized characters of the last, incomplete block.
+        self.pending = b""
+
+        # Set once the trailing guard (~>) is found. Whatever follows it is
+        # not part of the data.
+        self.ended = False
+
+    # Decodes as many complete blocks as possible and returns them.
+    def feed(self, chunk: bytes):
+        if self.ended:
+            return bytearray()
+
+        if self.head is not None:
+            self.head += chunk
+
+            if len(self.head) < 2:
+                return bytearray()
+
+            chunk = bytes(self.head)
+            self.head = None
+
+            if chunk[0 : 2] == b"<~":
+                chunk = chunk[2 : ]
+
+        # NOTE: "~" never appears inside a block, so the first one must be
+        # the start of the trailing guard, even if ">" is in the next chunk.
+        end = chunk.find(b"~")
+
+        if end != -1:
+            chunk = chunk[0 : end]
+            self.ended = True
+
+        byte_data = self.pending + _normalize(chunk)
+
+        # Keep the incomplete block for the next chunk.
+        complete_length = len(byte_data) - (len(byte_data) % 5)
+        self.pending = byte_data[complete_length : ]
+
+        return _decode_blocks(byte_data[0 : complete_length])
+
+    # Decodes the last, incomplete block (if any). The decoder must not be
+    # used anymore afterwards.
+    def finish(self):
+        byte_result = bytearray()
+
+        # Streams shorter than 2 bytes never got past the head.
+        if self.head is not None:
+            head, self.head = bytes(self.head), None
+            byte_result += self.feed(head)
+
+        # Calculate padding bytes required (must be a multiple of 5).
+        padding = (-len(self.pending) % 5)
+
+        if len(self.pending) != 0:
+            last_block = _decode_blocks(self.pending + b"u" * padding)
+            byte_result += last_block[0 : 4 - padding]
+
+        self.pending = b""
+        self.ended = True
+
+        return byte_result
+
+# Decodes an iterable of ASCII85-based chunks (e.g. a file read in blocks),
+# yielding the decoded data as soon as it's available.
+def decode_stream(chunks):
+    decoder = Decoder()
+
+    for chunk in chunks:
+        byte_result = decoder.feed(chunk)
+
+        if len(byte_result) != 0:
+            yield byte_result
+
+    byte_result = decoder.finish()
+
+    if len(byte_result) != 0:
+        yield byte_result
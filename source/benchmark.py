@@ -0,0 +1,203 @@
+import ascii85
+import base64
+import bitwise
+import os
+import packet
+import pipeline
+import pcap
+import resource
+import sys
+import tempfile
+import time
+import vm
+import vm_peephole
+import vm_profiler
+import vm_samples
+import xoring
+
+# Returns the time (in seconds) it takes to call "function" with the
+# given arguments, together with its result.
+def measure(function, *arguments):
+    start = time.perf_counter()
+    result = function(*arguments)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, result
+
+# Decodes the same ASCII85 payload with an increasing amount of worker
+# processes, to see how "ascii85.decode_parallel" scales.
+def benchmark_ascii85_parallel(size: int = 64 * 1024 * 1024):
+    byte_data = os.urandom(size)
+    encoded_data = base64.a85encode(byte_data, adobe = True, wrapcol = 76)
+
+    print("ascii85.decode_parallel, %d MB" % (size // (1024 * 1024)))
+
+    baseline, _ = measure(ascii85.decode, encoded_data)
+
+    for workers in range(1, (os.cpu_count() or 1) + 1):
+        elapsed, result = measure(ascii85.decode_parallel, encoded_data, workers, 0)
+        assert result == byte_data
+
+        print("  %2d worker(s): %8.3f s (%.2fx)" % (workers, elapsed, baseline / elapsed))
+
+# Decodes one byte at a time, the way "bitwise.decode" used to work before
+# using a translation table.
+def bitwise_decode_loop(byte_data: bytes):
+    byte_result = bytearray(len(byte_data))
+
+    for index, character in enumerate(byte_data):
+        byte_result[index] = bitwise.decode_byte(character)
+
+    return byte_result
+
+# Compares the throughput of "bitwise.decode" against the byte-per-byte
+# loop. The loop is skipped for sizes that would take too long.
+def benchmark_bitwise(sizes = (1, 10, 100), loop_limit: int = 10):
+    print("bitwise.decode")
+
+    for size in sizes:
+        byte_data = os.urandom(size * 1024 * 1024)
+
+        elapsed, result = measure(bitwise.decode, byte_data)
+        row = "  %3d MB: table %8.1f MB/s" % (size, size / elapsed)
+
+        if size <= loop_limit:
+            loop_elapsed, loop_result = measure(bitwise_decode_loop, byte_data)
+            assert result == loop_result
+
+            row += ", loop %8.1f MB/s (%.0fx)" % (size / loop_elapsed, loop_elapsed / elapsed)
+
+        print(row)
+
+# Returns the peak resident set size of the current process, in MB.
+def peak_memory():
+    # NOTE: Linux reports it in KB.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Writes the given datagrams over and over into a capture file, until it's
+# "size" bytes long.
+def write_capture(path: str, datagrams, size: int):
+    written = 0
+
+    with pcap.Writer(path) as writer:
+        while written < size:
+            for datagram in datagrams:
+                writer.write(datagram)
+                written += 16 + len(datagram)
+
+# Writes a capture file of the given size (in MB) and then decodes it using
+# "pcap.Reader", measuring its throughput and the peak memory used.
+def benchmark_pcap(size: int = 1024):
+    source_address = 0x0A01010A # 10.1.1.10
+    destination_address = 0x0A0101C8 # 10.1.1.200
+
+    datagrams = [packet.build_udp_packet(os.urandom(1024), source_address, destination_address, 1234, 42069 + (i % 2))
+                 for i in range(64)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture.pcap")
+
+        elapsed, _ = measure(write_capture, path, datagrams, size * 1024 * 1024)
+
+        print("pcap, %d MB" % size)
+        print("  write:  %8.1f MB/s" % (size / elapsed))
+
+        memory_before = peak_memory()
+
+        with pcap.Reader(path) as reader:
+            elapsed, result = measure(packet.decode_datagrams, reader)
+
+        print("  decode: %8.1f MB/s, %d MB decoded" % (size / elapsed, len(result) // (1024 * 1024)))
+        print("  peak memory: %.1f MB (%.1f MB before decoding)" % (peak_memory(), memory_before))
+
+def benchmark_vm(outer: int = 200, repetitions: int = 5):
+    program = vm_samples.countdown_program(outer)
+
+    interpreted, expected = measure(lambda: [vm.VM(bytearray(program)).run() for _ in range(repetitions)])
+    compiled, result = measure(lambda: [vm.VM(bytearray(program), jit = True).run() for _ in range(repetitions)])
+
+    assert result == expected
+
+    print("vm, countdown loop (%d outer iterations)" % outer)
+    print("  interpreted: %.3f s" % (interpreted / repetitions))
+    print("  compiled:    %.3f s (%.1fx)" % (compiled / repetitions, interpreted / compiled))
+
+# Compares the dispatches (and time) it takes to run sample programs with
+# and without superinstructions (see "vm_peephole").
+def benchmark_peephole(repetitions: int = 5):
+    programs = {
+        "countdown": vm_samples.countdown_program(),
+        "message": vm_samples.message_program(b"Hello, world!" * 1024),
+    }
+
+    print("vm superinstructions")
+
+    for name, program in programs.items():
+        dispatches = []
+        elapsed = []
+
+        for optimized in (False, True):
+            profiler = vm_profiler.Profiler()
+            machines = [vm.VM(bytearray(program)) for _ in range(repetitions)]
+
+            machine = vm.VM(bytearray(program), profiler = profiler)
+            machines.append(machine)
+
+            if optimized:
+                optimizing, _ = measure(lambda: [vm_peephole.optimize(machine) for machine in machines])
+
+            machine.run()
+            dispatches.append(profiler.instruction_count)
+
+            elapsed.append(measure(lambda: [machine.run() for machine in machines[ : -1]])[0] / repetitions)
+
+        print("  %s: %d -> %d dispatches (%.0f%% fewer), %.3f -> %.3f s (plus %.3f s optimizing)"
+              % (name, dispatches[0], dispatches[1], 100 * (1 - dispatches[1] / dispatches[0]),
+                 elapsed[0], elapsed[1], optimizing / (repetitions + 1)))
+
+# Compares running the layers one after the other, over whole buffers, with
+# running them as a pipeline (see "pipeline.Pipeline").
+def benchmark_pipeline(size: int = 64):
+    byte_data = os.urandom(size * 1024 * 1024)
+    onion = b"Layer instructions.\n\n" + ascii85.encode(bitwise.encode(xoring.xor(byte_data, xoring.key))) + b"\n"
+
+    stage_names = ["payload", "ascii85", "bitwise", "xoring"]
+
+    sequential = 0.0
+    result = onion
+
+    for name in stage_names:
+        stage = pipeline.stages[name]()
+        elapsed, result = measure(lambda: stage.feed(result) + stage.finish())
+        sequential += elapsed
+
+    assert result == byte_data
+
+    print("pipeline, %d MB" % size)
+    print("  sequential: %.3f s" % sequential)
+
+    for processes in (False, True):
+        engine = pipeline.Pipeline(stage_names, processes = processes)
+        elapsed, result = measure(engine.decode, onion)
+
+        assert result == byte_data
+
+        print("  %s: %.3f s" % ("processes" if processes else "threads", elapsed))
+        print("    " + engine.report().replace("\n", "\n    "))
+
+benchmarks = {
+    "ascii85_parallel": benchmark_ascii85_parallel,
+    "bitwise": benchmark_bitwise,
+    "pcap": benchmark_pcap,
+    "vm": benchmark_vm,
+    "peephole": benchmark_peephole,
+    "pipeline": benchmark_pipeline,
+}
+
+# Usage: python benchmark.py [name...]
+# Runs every benchmark if no name is given.
+if __name__ == "__main__":
+    names = sys.argv[1 : ] or list(benchmarks.keys())
+
+    for name in names:
+        benchmarks[name]()
@@ -1,160 +1,650 @@
-from copy import deepcopy
+import array
+import concurrent.futures
+import multiprocessing.shared_memory
+import os
+import struct
+import time
+
+from packet_filter import *
 
 class IPv4Header:
+    __slots__ = ("version", "ihl", "dscp", "ecn", "total_length", "identification",
+                 "flags", "fragment_offset", "ttl", "protocol", "checksum",
+                 "source_address", "destination_address", "options", "original_byte_data")
+
+    # Layout of the header (without options), in network (big-endian) order.
+    layout = struct.Struct(">BBHHHBBHII")
+
+    # Bits of the "flags" field.
+    DONT_FRAGMENT = 0b010
+    MORE_FRAGMENTS = 0b001
+
+    # Parses the header found at "offset" without copying it. "byte_header"
+    # can be any object supporting the buffer protocol.
     @classmethod
-    def from_bytes(cls, byte_header: bytes):
+    def from_bytes(cls, byte_header: bytes, offset: int = 0):
         # Create instance.
         self = cls()
 
-        self.version = byte_header[0] & 0b11110000 # First 4 bits.
-        self.ihl = byte_header[0] & 0b00001111 # Last 4 bits.
-        self.dscp = byte_header[1] & 0b11111100 # First 6 bits.
-        self.ecn = byte_header[1] & 0b00000011 # Last 2 bits.
-        self.total_length = int.from_bytes(byte_header[2 : 4], "big")
-        self.identification = int.from_bytes(byte_header[4 : 6], "big")
-        self.flags = byte_header[6] & 0b11100000 # First 3 bits.
-        self.fragment_offset = int.from_bytes(byte_header[6 : 8], "big")
-        self.fragment_offset &= 0b0001111111111111 # Last 13 bits.
-        self.ttl = byte_header[8]
-        self.protocol = byte_header[9]
-        self.checksum = int.from_bytes(byte_header[10 : 12], "big")
-        self.source_address = int.from_bytes(byte_header[12 : 16], "big")
-        self.destination_address = int.from_bytes(byte_header[16 : 20], "big")
-
-        # NOTE: There's an additional field, "options", but this layer's
-        # specification did not make any use of it (i.e. it will always
-        # be non-existant in this case) so I chose not to include it here.
-
-        # Copy.
-        self.original_byte_data = deepcopy(byte_header)
+        (version_ihl, dscp_ecn, self.total_length, self.identification, flags_fragment_offset,
+         self.ttl, self.protocol, self.checksum, self.source_address,
+         self.destination_address) = cls.layout.unpack_from(byte_header, offset)
+
+        self.version = version_ihl >> 4 # First 4 bits.
+        self.ihl = version_ihl & 0b00001111 # Last 4 bits, in 32-bit words.
+        self.dscp = dscp_ecn >> 2 # First 6 bits.
+        self.ecn = dscp_ecn & 0b00000011 # Last 2 bits.
+        self.flags = flags_fragment_offset >> 13 # First 3 bits.
+        self.fragment_offset = flags_fragment_offset & 0b0001111111111111 # Last 13 bits, in 8-byte units.
+
+        # Keep a reference to the original bytes (options included), instead
+        # of a copy.
+        byte_header = memoryview(byte_header)
+
+        self.options = byte_header[offset + cls.layout.size : offset + self.header_length]
+        self.original_byte_data = byte_header[offset : offset + self.header_length]
 
         return self
 
+    # Length of the header, options included, in bytes.
+    @property
+    def header_length(self):
+        return self.ihl * 4
+
+    # Whether the datagram is only a part of the original one.
+    @property
+    def is_fragment(self):
+        return (self.flags & self.MORE_FRAGMENTS) != 0 or self.fragment_offset != 0
+
 class UDPHeader:
+    __slots__ = ("source_port", "destination_port", "length", "checksum", "original_byte_data")
+
+    # Layout of the header, in network (big-endian) order.
+    layout = struct.Struct(">HHHH")
+
+    # Parses the header found at "offset" without copying it. "byte_header"
+    # can be any object supporting the buffer protocol.
     @classmethod
-    def from_bytes(cls, byte_header: bytes):
+    def from_bytes(cls, byte_header: bytes, offset: int = 0):
         # Create instance.
         self = cls()
 
-        self.source_port = int.from_bytes(byte_header[0 : 2], "big")
-        self.destination_port = int.from_bytes(byte_header[2 : 4], "big")
-        self.length = int.from_bytes(byte_header[4 : 6], "big")
-        self.checksum = int.from_bytes(byte_header[6 : 8], "big")
+        (self.source_port, self.destination_port, self.length,
+         self.checksum) = cls.layout.unpack_from(byte_header, offset)
 
-        # Copy.
-        self.original_byte_data = deepcopy(byte_header)
+        # Keep a reference to the original bytes, instead of a copy.
+        self.original_byte_data = memoryview(byte_header)[offset : offset + cls.layout.size]
 
         return self
 
-# NOTE: "byte_data" argument's length must be a multiple of 2 bytes.
-def verify_checksum(byte_data: bytes):
-    checksum = 0
-
-    for i in range(0, len(byte_data), 2):
-        # Convert the big-endian 16-bit value into an "int" object represented
-        # in the OS endianness. This does not affect the final result.
-        word = int.from_bytes(byte_data[i : i + 2], "big")
+# Adds the carry bits of "checksum" back into its first 16 bits, as many
+# times as needed for the result to fit inside 16 bits.
+def fold_checksum(checksum: int):
+    while checksum > 0xFFFF:
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
 
-        # Add 16-bit value.
-        checksum += word
+    return checksum
 
-    # Add carry bit. This is analogous to adding 1 if the carry bit is set,
-    # and 0 otherwise.
-    # NOTE: I did not come up with this idea. I found it on the Internet,
-    # but I don't remember where.
-    checksum += (checksum >> 16)
+# Returns the ones' complement sum of the big-endian 16-bit words in the
+# data, added to "initial". Data with an odd length is padded with a null
+# byte.
+def ones_complement_sum(byte_data: bytes, initial: int = 0):
+    # NOTE: Since 2^16 is 1 modulo 2^16 - 1, the whole data, read as a single
+    # number, is congruent with the sum of its 16-bit words. Both the
+    # conversion and the remainder work at C speed.
+    number = int.from_bytes(byte_data, "big")
 
-    # Discard excess bits, keeping only the first 16.
-    checksum = (checksum & 0b1111111111111111)
+    if len(byte_data) % 2 != 0:
+        number <<= 8
 
-    # Flip all bits.
-    checksum = (checksum ^ 0b1111111111111111)
+    checksum = number % 0xFFFF
 
-    return (checksum == 0)
+    # In ones' complement, 0xFFFF is zero as well, but it's the value a sum
+    # of non-zero words gets.
+    if checksum == 0 and number != 0:
+        checksum = 0xFFFF
 
-# Returns an UDP packet (header + data) preceeded by a "pseudo" IPv4 header.
-def build_pseudo_udp_packet(ipv4_header: IPv4Header, udp_header: UDPHeader, udp_data: bytes):
-    byte_result = bytearray()
+    return fold_checksum(checksum + initial)
 
-    # -- IPV4 PSEUDO HEADER
-    byte_result += ipv4_header.source_address.to_bytes(4, "big")
-    byte_result += ipv4_header.destination_address.to_bytes(4, "big")
+# Updates a checksum after one of the 16-bit words it covers changes from
+# "old_word" to "new_word", without going through the whole data again
+# (as described in RFC 1624).
+def update_checksum(checksum: int, old_word: int, new_word: int):
+    checksum = fold_checksum((checksum ^ 0xFFFF) + (old_word ^ 0xFFFF) + new_word)
 
-    byte_result += ipv4_header.protocol.to_bytes(2, "big")
-    byte_result += udp_header.length.to_bytes(2, "big")
+    return checksum ^ 0xFFFF
 
-    # -- UDP HEADER
-    byte_result += udp_header.source_port.to_bytes(2, "big")
-    byte_result += udp_header.destination_port.to_bytes(2, "big")
-    byte_result += udp_header.length.to_bytes(2, "big")
-    byte_result += udp_header.checksum.to_bytes(2, "big")
-
-    # -- UDP DATA
-    byte_result += udp_data
-
-    # Pad result to 2-bytes.
-    while (len(byte_result) % 2) != 0:
-        byte_result.append(0)
-
-    return byte_result
+def verify_checksum(byte_data: bytes, initial: int = 0):
+    # The checksum field is included in the data, so the sum of all of the
+    # words must have all bits set.
+    return ones_complement_sum(byte_data, initial) == 0xFFFF
 
 def ipv4_checksum_is_ok(ipv4_header: IPv4Header):
     return verify_checksum(ipv4_header.original_byte_data)
 
 def udp_checksum_is_ok(ipv4_header: IPv4Header, udp_header: UDPHeader, udp_data: bytes):
-    # Reconstruct the packet using the pseudo IPv4 information as noted
-    # in Wikipedia.
-    pseudo_packet = build_pseudo_udp_packet(ipv4_header, udp_header, udp_data)
+    # Add the pseudo IPv4 header's words as noted in Wikipedia, instead of
+    # building the pseudo header in front of a copy of the packet.
+    checksum = ipv4_header.source_address >> 16
+    checksum += ipv4_header.source_address & 0xFFFF
+    checksum += ipv4_header.destination_address >> 16
+    checksum += ipv4_header.destination_address & 0xFFFF
+    checksum += ipv4_header.protocol
+    checksum += udp_header.length
+
+    # The UDP header is 8 bytes long, so the data's words are aligned too.
+    checksum = ones_complement_sum(udp_header.original_byte_data, checksum)
 
-    return verify_checksum(pseudo_packet)
+    return verify_checksum(udp_data, checksum)
 
-def packet_is_ok(ipv4_header: IPv4Header, udp_header: UDPHeader, udp_data: bytes):
+# Only accepts packets sent from 10.1.1.10 to 10.1.1.200:42069, as the
+# instructions said.
+default_filter = PacketFilter([Rule("10.1.1.10", "10.1.1.200", destination_ports = 42069)])
+
+def checksums_are_ok(ipv4_header: IPv4Header, udp_header: UDPHeader, udp_data: bytes):
     if not ipv4_checksum_is_ok(ipv4_header):
         return False
 
     if not udp_checksum_is_ok(ipv4_header, udp_header, udp_data):
         return False
 
-    expected_source_address = bytes([10, 1, 1, 10]) # 10.1.1.10
-    expected_destination_address = bytes([10, 1, 1, 200]) # 10.1.1.200
-    expected_destination_port = 42069
+    return True
 
-    source_address = ipv4_header.source_address.to_bytes(4, "big")
-    destination_address = ipv4_header.destination_address.to_bytes(4, "big")
-    destination_port = udp_header.destination_port
+def packet_is_ok(ipv4_header: IPv4Header, udp_header: UDPHeader, udp_data: bytes,
+                 packet_filter: PacketFilter = None):
+    if packet_filter is None:
+        packet_filter = default_filter
 
-    if source_address != expected_source_address:
+    # NOTE: Filtering is way cheaper than verifying checksums, so it's done
+    # first.
+    if not packet_filter.accepts_headers(ipv4_header, udp_header):
         return False
 
-    if destination_address != expected_destination_address:
+    return checksums_are_ok(ipv4_header, udp_header, udp_data)
+
+# Layout of the total length field of the IPv4 header.
+_total_length_layout = struct.Struct(">H")
+
+# Layout of the flags and fragment offset fields of the IPv4 header.
+_fragment_fields_layout = struct.Struct(">H")
+
+# Goes through the data, without parsing nor validating anything but each
+# packet's length, and returns the offset of every packet.
+#
+# If "partial" is set, the data may end in the middle of a packet (e.g. when
+# it arrives in chunks), which is left out.
+def index_packets(byte_data: bytes, partial: bool = False):
+    # NOTE: Offsets are 64-bit, as captures can be larger than 4 GiB.
+    offsets = array.array("Q")
+    offset = 0
+
+    while offset < len(byte_data):
+        if partial and offset + 4 > len(byte_data):
+            break
+
+        # Move on. The IPv4 header's total length field contains the size of
+        # the IPv4 header + UDP header + Payload.
+        total_length, = _total_length_layout.unpack_from(byte_data, offset + 2)
+
+        if total_length == 0:
+            raise ValueError("Packet at offset %d has a total length of 0" % offset)
+
+        if partial and offset + total_length > len(byte_data):
+            break
+
+        offsets.append(offset)
+        offset += total_length
+
+    return offsets
+
+# Returns the length of the IPv4 header of the packet at "offset", using
+# its IHL field.
+def _get_header_length(byte_data: bytes, offset: int):
+    return (byte_data[offset] & 0b00001111) * 4
+
+# Returns whether any of the packets at the given offsets is a fragment.
+def _has_fragments(byte_data: bytes, offsets):
+    unpack_from = _fragment_fields_layout.unpack_from
+
+    for offset in offsets:
+        # Any of the "more fragments" flag or the fragment offset set.
+        if unpack_from(byte_data, offset + 6)[0] & 0b0011111111111111:
+            return True
+
+    return False
+
+# Returns the UDP header and data of the packet at "offset".
+def _get_udp_data(byte_data: memoryview, offset: int):
+    offset += _get_header_length(byte_data, offset)
+
+    udp_header = UDPHeader.from_bytes(byte_data, offset)
+
+    # NOTE: We subtract 8 since that's the length of the UDP header.
+    udp_data = byte_data[offset + 8 : offset + 8 + (udp_header.length - 8)]
+
+    return udp_header, udp_data
+
+# Layout of the fields used for filtering, starting from the IPv4 header's
+# protocol field: protocol, checksum (skipped), source and destination
+# addresses. Ports come right after the IPv4 header, options included.
+_filtered_fields_layout = struct.Struct(">B2xII")
+_filtered_ports_layout = struct.Struct(">HH")
+
+# Returns whether the "length" bytes long packet at "offset" is long enough
+# to hold its IPv4 and UDP headers, and says it carries UDP. Ports can only
+# be read from those (e.g. by "_get_filtered_fields").
+def _carries_udp(byte_data: bytes, offset: int, length: int):
+    if length < 20:
         return False
 
-    if destination_port != expected_destination_port:
+    header_length = _get_header_length(byte_data, offset)
+
+    # NOTE: An IHL under 5 means the header is shorter than its own fixed
+    # fields, so the packet is malformed.
+    if header_length < 20:
         return False
 
-    return True
+    return byte_data[offset + 9] == 17 and length >= header_length + 8
+
+# Returns the fields used for filtering of the packet at "offset", in the
+# order taken by "PacketFilter.accepts". The packet must carry UDP (see
+# "_carries_udp").
+def _get_filtered_fields(byte_data: bytes, offset: int):
+    protocol, source_address, destination_address = _filtered_fields_layout.unpack_from(byte_data, offset + 9)
+    source_port, destination_port = _filtered_ports_layout.unpack_from(byte_data,
+                                                                       offset + _get_header_length(byte_data, offset))
+
+    return source_address, destination_address, protocol, source_port, destination_port
+
+# Filters the packets at the given offsets, returning a flag per packet (1 if
+# the packet is accepted, 0 otherwise). Only the filtered fields are read,
+# without parsing whole headers.
+def filter_packets(byte_data: bytes, offsets, packet_filter: PacketFilter = None):
+    if packet_filter is None:
+        packet_filter = default_filter
+
+    flags = bytearray(len(offsets))
+
+    accepts = packet_filter.accepts
+    total_length_at = _total_length_layout.unpack_from
+
+    for i, offset in enumerate(offsets):
+        # NOTE: The last packet may be cut short.
+        length = min(total_length_at(byte_data, offset + 2)[0], len(byte_data) - offset)
+
+        if _carries_udp(byte_data, offset, length) and accepts(*_get_filtered_fields(byte_data, offset)):
+            flags[i] = 1
+
+    return flags
+
+# Validates the packets at the given offsets, returning a flag per packet
+# (1 if the packet is OK, 0 otherwise). Checksums are only verified for the
+# packets accepted by the filter.
+def validate_packets(byte_data: bytes, offsets, packet_filter: PacketFilter = None):
+    flags = filter_packets(byte_data, offsets, packet_filter)
+    byte_data = memoryview(byte_data)
+
+    for i, offset in enumerate(offsets):
+        if not flags[i]:
+            continue
+
+        ipv4_header = IPv4Header.from_bytes(byte_data, offset)
+        udp_header, udp_data = _get_udp_data(byte_data, offset)
+
+        if not checksums_are_ok(ipv4_header, udp_header, udp_data):
+            flags[i] = 0
+
+    return flags
 
-# NOTE: Since Python passes parameters by object reference, and since "bytes" is
-# an immutable object, no copy is needed because the original data is never
-# modified.
-def decode(byte_data: bytes):
+# Joins the data of every valid packet, in their original order.
+def assemble_packets(byte_data: bytes, offsets, flags: bytearray):
     byte_result = bytearray()
+    byte_data = memoryview(byte_data)
 
-    while len(byte_data) > 0:
-        # NOTE: I know that the IPv4 header may have a different width in real
-        # situations; however, the instructions said that in this case, it is
-        # ALWAYS 20 bytes long.
-        ipv4_header = IPv4Header.from_bytes(byte_data[0 : 20])
-        udp_header = UDPHeader.from_bytes(byte_data[20 : 28])
+    for offset, flag in zip(offsets, flags):
+        if flag:
+            _, udp_data = _get_udp_data(byte_data, offset)
+            byte_result += udp_data
 
-        # NOTE: We subtract 8 since that's the length of the UDP header.
-        udp_data = byte_data[28 : 28 + (udp_header.length - 8)]
+    return byte_result
 
-        # Move on. The IPv4 header's total length field contains the size of
-        # the IPv4 header + UDP header + Payload.
-        byte_data = byte_data[ipv4_header.total_length : len(byte_data)]
+# NOTE: The data is never copied nor sliced; packets are parsed straight
+# from the original buffer, using their offsets.
+def decode(byte_data: bytes, packet_filter: PacketFilter = None):
+    offsets = index_packets(byte_data)
+
+    # Fragments must be reassembled (in the order they arrive) before they
+    # can be validated.
+    if _has_fragments(byte_data, offsets):
+        byte_data = memoryview(byte_data)
+        total_length_at = _total_length_layout.unpack_from
+
+        datagrams = (byte_data[offset : offset + total_length_at(byte_data, offset + 2)[0]] for offset in offsets)
+
+        return decode_datagrams(datagrams, packet_filter)
+
+    flags = validate_packets(byte_data, offsets, packet_filter)
+
+    return assemble_packets(byte_data, offsets, flags)
+
+# Same as "decode", but for an iterable of separate datagrams (e.g. the
+# records of a capture file, see "pcap.Reader") instead of a single buffer.
+# Fragmented datagrams are reassembled using "reassembler", or a new
+# "Reassembler" if not given.
+#
+# Datagrams may also be given as (timestamp, datagram) tuples, so fragments
+# expire by the time they were captured at rather than by how fast they're
+# decoded. A "pcap.Reader" is read that way.
+def decode_datagrams(datagrams, packet_filter: PacketFilter = None, reassembler: "Reassembler" = None):
+    if packet_filter is None:
+        packet_filter = default_filter
+
+    if reassembler is None:
+        reassembler = Reassembler()
+
+    # NOTE: Not imported, as capture files are only one of many sources.
+    if hasattr(datagrams, "timestamped_datagrams"):
+        datagrams = datagrams.timestamped_datagrams()
+
+    byte_result = bytearray()
+
+    accepts = packet_filter.accepts
+    fragment_fields_at = _fragment_fields_layout.unpack_from
+
+    for datagram in datagrams:
+        timestamp = None
+
+        if isinstance(datagram, tuple):
+            timestamp, datagram = datagram
+
+        datagram = memoryview(datagram)
+
+        # Too short for an IPv4 header (e.g. cut short by the capture).
+        if len(datagram) < 20:
+            continue
 
-        if packet_is_ok(ipv4_header, udp_header, udp_data):
+        if fragment_fields_at(datagram, 6)[0] & 0b0011111111111111:
+            ipv4_header = IPv4Header.from_bytes(datagram)
+
+            # Each fragment has its own header, with its own checksum.
+            if not ipv4_checksum_is_ok(ipv4_header):
+                continue
+
+            datagram = reassembler.add(ipv4_header, datagram, timestamp)
+
+            if datagram is None:
+                continue
+
+            datagram = memoryview(datagram)
+
+        if not _carries_udp(datagram, 0, len(datagram)) or not accepts(*_get_filtered_fields(datagram, 0)):
+            continue
+
+        ipv4_header = IPv4Header.from_bytes(datagram)
+        udp_header, udp_data = _get_udp_data(datagram, 0)
+
+        if checksums_are_ok(ipv4_header, udp_header, udp_data):
             byte_result += udp_data
 
     return byte_result
+
+# Data of a datagram being reassembled, written in place as its fragments
+# arrive.
+class _FragmentBuffer:
+    __slots__ = ("created", "header", "data", "received", "received_blocks", "length")
+
+    def __init__(self, created: float):
+        self.created = created
+
+        # Header of the first fragment, which is the one that's kept.
+        self.header = None
+
+        self.data = bytearray()
+
+        # Whether each 8-byte block of data was received (1) or not (0), and
+        # how many of them were.
+        self.received = bytearray()
+        self.received_blocks = 0
+
+        # Length of the data, known once the last fragment arrives.
+        self.length = None
+
+    # Writes a fragment's data at "start", and returns the amount of bytes
+    # allocated to do so, or "None" if the fragment contradicts the ones
+    # before it (it ends past the datagram's end, or it's a last fragment
+    # that comes before data already received or another last fragment).
+    def store(self, start: int, fragment_data: memoryview, is_last: bool):
+        end = start + len(fragment_data)
+        allocated = 0
+
+        if self.length is not None and (end > self.length or (is_last and end != self.length)):
+            return None
+
+        if is_last:
+            if self.received.find(1, -(-end // 8)) != -1:
+                return None
+
+            self.length = end
+
+        # Preallocate the whole datagram once its length is known, or as much
+        # as needed until then (but twice as much to avoid growing it for
+        # every fragment).
+        if len(self.data) < end:
+            size = self.length if self.length is not None else min(max(end, 2 * len(self.data)), 0xFFFF)
+            allocated += size - len(self.data)
+            self.data.extend(bytes(size - len(self.data)))
+
+        self.data[start : end] = fragment_data
+
+        first_block = start // 8
+        last_block = -(-end // 8)
+
+        if len(self.received) < last_block:
+            allocated += last_block - len(self.received)
+            self.received.extend(bytes(last_block - len(self.received)))
+
+        self.received_blocks += self.received.count(0, first_block, last_block)
+        self.received[first_block : last_block] = b"\x01" * (last_block - first_block)
+
+        return allocated
+
+    def is_complete(self):
+        if self.length is None or self.header is None:
+            return False
+
+        return self.received_blocks == -(-self.length // 8)
+
+    def memory_used(self):
+        return len(self.data) + len(self.received)
+
+    # Returns the reassembled datagram, using the first fragment's header.
+    def build(self):
+        header_length = len(self.header)
+
+        byte_result = bytearray(header_length + self.length)
+        byte_result[0 : header_length] = self.header
+        byte_result[header_length : ] = memoryview(self.data)[0 : self.length]
+
+        # Update the total length, clear the fragmentation fields (keeping the
+        # "don't fragment" flag) and the checksum, and compute it again.
+        byte_result[2 : 4] = len(byte_result).to_bytes(2, "big")
+        byte_result[6] &= (IPv4Header.DONT_FRAGMENT << 5)
+        byte_result[7] = 0
+        byte_result[10 : 12] = bytes(2)
+
+        checksum = ones_complement_sum(memoryview(byte_result)[0 : header_length]) ^ 0xFFFF
+        byte_result[10 : 12] = checksum.to_bytes(2, "big")
+
+        return byte_result
+
+# Reassembles fragmented IPv4 datagrams, keyed by source address,
+# destination address, identification and protocol. Datagrams whose
+# fragments don't all arrive within "timeout" seconds are dropped, and so
+# are the oldest ones if the memory used goes over "memory_limit" bytes.
+class Reassembler:
+    def __init__(self, timeout: float = 30.0, memory_limit: int = 64 * 1024 * 1024):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+
+        # NOTE: Dictionaries keep insertion order, so the oldest datagram is
+        # always the first one.
+        self.buffers = {}
+
+    # Adds a fragment, returning the reassembled datagram if it was the last
+    # missing one, or "None" otherwise (fragments with an IHL under 5 are
+    # malformed, and are dropped as well). "timestamp" (in seconds) defaults
+    # to the current time, but captures should give their own (see
+    # "decode_datagrams").
+    def add(self, ipv4_header: IPv4Header, datagram: bytes, timestamp: float = None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        self.expire(timestamp)
+
+        if ipv4_header.ihl < 5:
+            return None
+
+        key = (ipv4_header.source_address, ipv4_header.destination_address,
+               ipv4_header.identification, ipv4_header.protocol)
+
+        buffer = self.buffers.get(key)
+
+        if buffer is None:
+            buffer = _FragmentBuffer(timestamp)
+            self.buffers[key] = buffer
+
+        start = ipv4_header.fragment_offset * 8
+        fragment_data = memoryview(datagram)[ipv4_header.header_length : ipv4_header.total_length]
+
+        # Datagrams cannot be longer than 65535 bytes, header included.
+        if start + len(fragment_data) + ipv4_header.header_length > 0xFFFF:
+            self.drop(key)
+            return None
+
+        is_last = (ipv4_header.flags & IPv4Header.MORE_FRAGMENTS) == 0
+        allocated = buffer.store(start, fragment_data, is_last)
+
+        # Malformed datagrams can't be reassembled.
+        if allocated is None:
+            self.drop(key)
+            return None
+
+        self.memory_used += allocated
+
+        if start == 0:
+            buffer.header = bytes(ipv4_header.original_byte_data)
+
+        if buffer.is_complete():
+            self.drop(key)
+            return buffer.build()
+
+        # Drop the oldest datagrams (maybe this one) until there's enough
+        # memory.
+        while self.memory_used > self.memory_limit:
+            self.drop(next(iter(self.buffers)))
+
+        return None
+
+    # Drops the datagrams that have been waiting for too long.
+    def expire(self, timestamp: float):
+        while len(self.buffers) != 0:
+            key, buffer = next(iter(self.buffers.items()))
+
+            if timestamp - buffer.created <= self.timeout:
+                break
+
+            self.drop(key)
+
+    def drop(self, key):
+        buffer = self.buffers.pop(key)
+        self.memory_used -= buffer.memory_used()
+
+# Builds an IPv4 + UDP packet carrying "udp_data", with valid checksums.
+# Addresses are given as integers.
+def build_udp_packet(udp_data: bytes, source_address: int, destination_address: int,
+                     source_port: int, destination_port: int, identification: int = 0):
+    udp_length = 8 + len(udp_data)
+
+    byte_result = bytearray(28)
+    byte_result += udp_data
+
+    # Version 4, 20 bytes long header, and a TTL of 64 hops.
+    IPv4Header.layout.pack_into(byte_result, 0, 0x45, 0, 20 + udp_length, identification,
+                                0, 64, 17, 0, source_address, destination_address)
+    UDPHeader.layout.pack_into(byte_result, 20, source_port, destination_port, udp_length, 0)
+
+    ipv4_checksum = ones_complement_sum(memoryview(byte_result)[0 : 20]) ^ 0xFFFF
+    byte_result[10 : 12] = ipv4_checksum.to_bytes(2, "big")
+
+    # Add the pseudo IPv4 header's words (see "udp_checksum_is_ok").
+    pseudo_header_sum = (source_address >> 16) + (source_address & 0xFFFF)
+    pseudo_header_sum += (destination_address >> 16) + (destination_address & 0xFFFF)
+    pseudo_header_sum += 17 + udp_length
+
+    udp_checksum = ones_complement_sum(memoryview(byte_result)[20 : ], pseudo_header_sum) ^ 0xFFFF
+    byte_result[26 : 28] = udp_checksum.to_bytes(2, "big")
+
+    return byte_result
+
+# Validates the packets in "offsets" from a shared memory block created by
+# "decode_parallel". Runs on a worker process.
+def _validate_shared_packets(shared_memory_name: str, offsets, packet_filter: PacketFilter):
+    shared_memory = multiprocessing.shared_memory.SharedMemory(name = shared_memory_name)
+
+    try:
+        return validate_packets(shared_memory.buf, offsets, packet_filter)
+    finally:
+        shared_memory.close()
+
+# Captures smaller than this (in bytes) are not worth sending to other
+# processes, and are decoded in the current one instead.
+parallel_threshold = 64 * 1024 * 1024
+
+# Packets validated by each task of "decode_parallel".
+parallel_batch_length = 16 * 1024
+
+# Same as "decode", but the packets are validated in batches by a pool of
+# processes (unless there are fragments, see "decode"). The data is placed
+# in shared memory once, so that only the offsets of each batch are sent to
+# the workers.
+def decode_parallel(byte_data: bytes, workers: int = None, threshold: int = None,
+                    packet_filter: PacketFilter = None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if threshold is None:
+        threshold = parallel_threshold
+
+    if workers <= 1 or len(byte_data) < threshold:
+        return decode(byte_data, packet_filter)
+
+    if packet_filter is None:
+        packet_filter = default_filter
+
+    offsets = index_packets(byte_data)
+
+    # Fragments must be reassembled in the order they arrive, which can't be
+    # split among processes.
+    if _has_fragments(byte_data, offsets):
+        return decode(byte_data, packet_filter)
+
+    shared_memory = multiprocessing.shared_memory.SharedMemory(create = True, size = max(len(byte_data), 1))
+
+    try:
+        shared_memory.buf[0 : len(byte_data)] = byte_data
+
+        batches = [offsets[i : i + parallel_batch_length] for i in range(0, len(offsets), parallel_batch_length)]
+        flags = bytearray()
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+            # NOTE: "map" returns the results in the same order as the batches,
+            # regardless of which one finishes first.
+            for batch_flags in executor.map(_validate_shared_packets, [shared_memory.name] * len(batches),
+                                            batches, [packet_filter] * len(batches)):
+                flags += batch_flags
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+    return assemble_packets(byte_data, offsets, flags)
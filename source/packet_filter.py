@@ -0,0 +1,179 @@
+import bisect
+import ipaddress
+
+# Fields matched against ranges by the rules, in the order of "Rule.ranges",
+# and the largest value of each of them.
+range_fields = (
+    ("source_address", 0xFFFFFFFF),
+    ("destination_address", 0xFFFFFFFF),
+    ("source_port", 0xFFFF),
+    ("destination_port", 0xFFFF),
+)
+
+# Splits the values of a field into the intervals between the bounds of the
+# given ranges, where each range is matched by one rule. Returns the first
+# value of every interval, sorted, and the rules matching each of them as
+# bit masks (bit "i" for the "i"-th range).
+def _build_intervals(ranges):
+    # Every range flips its rule's bit where it starts and right after it
+    # ends.
+    flips = {0: 0}
+
+    for i, (first, last) in enumerate(ranges):
+        flips[first] = flips.get(first, 0) ^ (1 << i)
+        flips[last + 1] = flips.get(last + 1, 0) ^ (1 << i)
+
+    starts = sorted(flips)
+    masks = []
+    mask = 0
+
+    for start in starts:
+        mask ^= flips[start]
+        masks.append(mask)
+
+    return starts, masks
+
+# Accepts the packets that match all of its fields. Addresses are given in
+# CIDR notation (e.g. "10.1.1.0/24", or "10.1.1.10" for a single address),
+# ports as a single port or an inclusive (first, last) range, and "None"
+# matches anything.
+class Rule:
+    def __init__(self, source: str = "0.0.0.0/0", destination: str = "0.0.0.0/0",
+                 source_ports = None, destination_ports = None, protocol: int = None):
+        self.source = source
+        self.destination = destination
+        self.source_ports = source_ports
+        self.destination_ports = destination_ports
+        self.protocol = protocol
+
+    # Returns the network address and the mask of a CIDR block, as integers.
+    @staticmethod
+    def _parse_network(network: str):
+        network = ipaddress.IPv4Network(network, strict = False)
+
+        return int(network.network_address), int(network.netmask)
+
+    # Returns the first and last port of a range, both included.
+    @staticmethod
+    def _parse_ports(ports):
+        if ports is None:
+            return 0, 0xFFFF
+
+        if isinstance(ports, int):
+            return ports, ports
+
+        return ports[0], ports[1]
+
+    # Returns the inclusive (first, last) range of values matched for each
+    # of the source address, destination address, source port and
+    # destination port, in that order (see "range_fields").
+    def ranges(self):
+        ranges = []
+
+        for network in (self.source, self.destination):
+            address, mask = self._parse_network(network)
+            ranges.append((address, address | (mask ^ 0xFFFFFFFF)))
+
+        for ports in (self.source_ports, self.destination_ports):
+            ranges.append(self._parse_ports(ports))
+
+        return ranges
+
+    # Returns the (source address, destination address, destination port)
+    # tuple matched by this rule if it matches exactly one of each, and
+    # nothing else; otherwise, returns "None".
+    def exact_key(self):
+        source, source_mask = self._parse_network(self.source)
+        destination, destination_mask = self._parse_network(self.destination)
+        first, last = self._parse_ports(self.destination_ports)
+
+        if source_mask != 0xFFFFFFFF or destination_mask != 0xFFFFFFFF or first != last:
+            return None
+
+        if self.source_ports is not None or self.protocol is not None:
+            return None
+
+        return source, destination, first
+
+# Accepts the packets that match any of its rules. The rules are compiled
+# once into a single Python function. Rules matching a single source,
+# destination and destination port (the most common ones) are looked up in
+# a set, so adding more of them costs nothing.
+#
+# Every other rule is a bit in a bit mask. The values of each field are
+# split into sorted intervals, each with the mask of the rules matching it,
+# so a packet is matched by finding its intervals (with "bisect") and
+# joining their masks. Its cost grows with the logarithm of the number of
+# rules, rather than with the number of rules.
+class PacketFilter:
+    def __init__(self, rules):
+        self.rules = list(rules)
+
+        exact_keys = set()
+        range_rules = []
+
+        for rule in self.rules:
+            exact_key = rule.exact_key()
+
+            if exact_key is not None:
+                exact_keys.add(exact_key)
+            else:
+                range_rules.append(rule)
+
+        namespace = {"bisect": bisect.bisect_right, "exact_keys": frozenset(exact_keys)}
+        lines = ["def accepts(source_address, destination_address, protocol, source_port, destination_port):"]
+
+        if len(exact_keys) != 0:
+            lines.append("    if (source_address, destination_address, destination_port) in exact_keys:")
+            lines.append("        return True")
+
+        if len(range_rules) != 0:
+            lines.append("    rules = %d" % ((1 << len(range_rules)) - 1))
+
+            rule_ranges = [rule.ranges() for rule in range_rules]
+
+            for i, (name, largest) in enumerate(range_fields):
+                field_ranges = [ranges[i] for ranges in rule_ranges]
+
+                # Fields that no rule limits are left out.
+                if all(field_range == (0, largest) for field_range in field_ranges):
+                    continue
+
+                starts, masks = _build_intervals(field_ranges)
+                namespace[name + "_starts"] = starts
+                namespace[name + "_masks"] = masks
+
+                lines.append("    rules &= %s_masks[bisect(%s_starts, %s) - 1]" % (name, name, name))
+
+            # Rules that don't mention a protocol match every protocol.
+            if any(rule.protocol is not None for rule in range_rules):
+                any_protocol = sum(1 << i for i, rule in enumerate(range_rules) if rule.protocol is None)
+                protocol_masks = {}
+
+                for i, rule in enumerate(range_rules):
+                    if rule.protocol is not None:
+                        protocol_masks[rule.protocol] = protocol_masks.get(rule.protocol, any_protocol) | (1 << i)
+
+                namespace["protocol_masks"] = protocol_masks
+                lines.append("    rules &= protocol_masks.get(protocol, %d)" % any_protocol)
+
+            lines.append("    return rules != 0")
+        else:
+            lines.append("    return False")
+
+        exec("\n".join(lines), namespace)
+
+        self.code = "\n".join(lines)
+
+        # Takes the addresses and ports as integers, and returns whether the
+        # packet is accepted.
+        self.accepts = namespace["accepts"]
+
+    # NOTE: Compiled functions cannot be pickled, so filters are sent to
+    # other processes as their rules, and compiled again.
+    def __reduce__(self):
+        return (PacketFilter, (self.rules,))
+
+    def accepts_headers(self, ipv4_header, udp_header):
+        return self.accepts(ipv4_header.source_address, ipv4_header.destination_address,
+                            ipv4_header.protocol, udp_header.source_port, udp_header.destination_port)
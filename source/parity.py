@@ -1,3 +1,10 @@
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def count_bits_turned_on(byte: int):
     count = 0
 
@@ -8,50 +15,120 @@ def count_bits_turned_on(byte: int):
 
     return count
 
-def get_data_carrying_bits(byte: int):
-    # Resulting bit stream.
-    result = ""
+# Bytes whose parity bit does not match the amount of bits turned on. These
+# are discarded.
+# NOTE: If the number of bits turned on is even, then the parity bit should
+# be 0, otherwise it must be 1.
+invalid_bytes = bytes(b for b in range(256) if (count_bits_turned_on(b) % 2) != (b & 1))
 
-    # NOTE: All bits (except the LSB) must be analyzed since leading
-    # 0 bits are also important. This cannot be achieved using
-    # built-in functions like "bin" since they discard unimportant
-    # zeros.
-    # MSB -> LSB (not included).
-    for i in range(7, 0, -1):
-        if byte & (2 ** i):
-            result += "1"
-        else:
-            result += "0"
+# Maps each byte into its data carrying bits, which are the 7 bits other
+# than the parity bit (LSB).
+data_bits_table = bytes(b >> 1 for b in range(256))
 
-    return result
+# Appends 7-bit values (one at a time) to an accumulator of "carry_length"
+# bits, storing every complete byte in "byte_result". Returns the bits that
+# didn't make up a whole byte.
+def _accumulate(values, carry: int, carry_length: int, byte_result: bytearray):
+    for value in values:
+        carry = (carry << 7) | value
+        carry_length += 7
 
-def decode(byte_data: bytes):
-    # Result of the operation.
+        if carry_length >= 8:
+            carry_length -= 8
+            byte_result.append(carry >> carry_length)
+            carry &= (1 << carry_length) - 1
+
+    return carry, carry_length
+
+# Packs 7-bit values whose amount is a multiple of 8, which fit exactly
+# inside 7 bytes per every 8 values.
+def _pack_groups(values: bytes):
+    group_count = len(values) // 8
+
+    if numpy is not None:
+        # Split every value into its bits (MSB first), drop the first one
+        # (which is always 0) and join them all back together.
+        bits = numpy.frombuffer(values, dtype = numpy.uint8).reshape(-1, 1)
+        bits = numpy.unpackbits(bits, axis = 1)[:, 1 : ]
+
+        return bytearray(numpy.packbits(bits.ravel()).tobytes())
+
+    # Join every group of 8 values inside the first 56 bits of a 64-bit word,
+    # and then discard the 8th (unused) byte of each word.
+    groups = zip(*([iter(values)] * 8))
+    words = [(a << 57) | (b << 50) | (c << 43) | (d << 36) | (e << 29) | (f << 22) | (g << 15) | (h << 8)
+             for a, b, c, d, e, f, g, h in groups]
+
+    byte_result = bytearray(struct.pack(">%dQ" % group_count, *words))
+    del byte_result[7 : : 8]
+
+    return byte_result
+
+# Packs 7-bit values into bytes, after the "carry_length" bits in "carry"
+# that were left over from previous values. Returns the packed bytes and the
+# bits (less than 8) that are left over this time.
+def pack_data_bits(values: bytes, carry: int = 0, carry_length: int = 0):
     byte_result = bytearray()
 
-    # Temporal bit stream which will be converted to bytes when possible.
-    bit_stream = ""
+    # Each value adds 7 bits, so after "carry_length" values (which is less
+    # than 8) there won't be any bits left over, and the rest of the values
+    # can be packed in groups of 8.
+    head_length = min(carry_length, len(values))
+    carry, carry_length = _accumulate(values[0 : head_length], carry, carry_length, byte_result)
+
+    if carry_length != 0:
+        return byte_result, carry, carry_length
 
-    for b in byte_data:
-        # Count all non-LSB non-zero bits and get the parity bit, which
-        # is the LSB.
-        bits_turned_on = count_bits_turned_on(b)
-        parity_bit = b & 1
+    end = head_length + (len(values) - head_length) // 8 * 8
+    byte_result += _pack_groups(values[head_length : end])
 
-        # If the number of bits turned on is even, then the parity bit
-        # should be 0, otherwise it must be 1.
-        if (bits_turned_on % 2) == parity_bit:
-            # This byte's parity bit is OK, get the data carrying bits,
-            # which are the other 7 bits, and store them.
-            data_bits = get_data_carrying_bits(b)
-            bit_stream += data_bits
+    carry, carry_length = _accumulate(values[end : ], 0, 0, byte_result)
 
-            while len(bit_stream) >= 8:
-                # Convert the first 8 characters into a number,
-                # effectively converting bits to an integer.
-                byte_result.append(int(bit_stream[0 : 8], 2))
+    return byte_result, carry, carry_length
+
+def decode(byte_data: bytes):
+    # Discard the bytes whose parity bit is not OK, and get the data carrying
+    # bits of the rest, all at once.
+    values = byte_data.translate(data_bits_table, invalid_bytes)
 
-                # Discard first 8 characters.
-                bit_stream = bit_stream[8 : len(bit_stream)]
+    # Bits that do not make up a whole byte at the end are ignored.
+    byte_result, _, _ = pack_data_bits(values)
 
     return byte_result
+
+# Decodes the parity layer incrementally, one chunk at a time. The bits
+# that don't make up a whole byte (7 at most) are carried over from one
+# chunk to the next.
+class Decoder:
+    def __init__(self):
+        self.carry = 0
+        self.carry_length = 0
+
+    # Returns every complete byte decoded so far.
+    def feed(self, chunk: bytes):
+        values = chunk.translate(data_bits_table, invalid_bytes)
+
+        byte_result, self.carry, self.carry_length = pack_data_bits(values, self.carry, self.carry_length)
+
+        return byte_result
+
+    # Bits that do not make up a whole byte at the end are ignored, so there's
+    # nothing else to return.
+    def finish(self):
+        self.carry = 0
+        self.carry_length = 0
+
+        return bytearray()
+
+# Decodes an iterable of chunks (e.g. the output of "ascii85.decode_stream"),
+# yielding the decoded data as soon as it's available.
+def decode_stream(chunks):
+    decoder = Decoder()
+
+    for chunk in chunks:
+        byte_result = decoder.feed(chunk)
+
+        if len(byte_result) != 0:
+            yield byte_result
+
+    decoder.finish()
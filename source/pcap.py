@@ -0,0 +1,275 @@
+import mmap
+import struct
+
+# Link-layer types (as stored in capture files) whose records carry IPv4
+# datagrams, and the length of the header preceding the datagram.
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+
+# Magic numbers of the (classic) pcap format, in microseconds and
+# nanoseconds, and of the pcapng format's section header block.
+_pcap_magic = 0xA1B2C3D4
+_pcap_nanoseconds_magic = 0xA1B23C4D
+_pcapng_section_header_block = 0x0A0D0D0A
+_pcapng_byte_order_magic = 0x1A2B3C4D
+
+# pcapng block types.
+_pcapng_interface_description_block = 0x00000001
+_pcapng_simple_packet_block = 0x00000003
+_pcapng_enhanced_packet_block = 0x00000006
+
+# Returns the IPv4 datagram carried by a record, or "None" if it carries
+# something else.
+def _get_ipv4_datagram(record: memoryview, link_type: int):
+    if link_type == LINKTYPE_RAW or link_type == LINKTYPE_IPV4:
+        datagram = record
+    elif link_type == LINKTYPE_ETHERNET:
+        ether_type = int.from_bytes(record[12 : 14], "big")
+        header_length = 14
+
+        # Skip 802.1Q (VLAN) tags.
+        while ether_type == 0x8100 and len(record) >= header_length + 4:
+            ether_type = int.from_bytes(record[header_length + 2 : header_length + 4], "big")
+            header_length += 4
+
+        if ether_type != 0x0800:
+            return None
+
+        datagram = record[header_length : ]
+    elif link_type == LINKTYPE_LINUX_SLL:
+        if int.from_bytes(record[14 : 16], "big") != 0x0800:
+            return None
+
+        datagram = record[16 : ]
+    elif link_type == LINKTYPE_NULL:
+        # The address family is stored in the host's byte order.
+        if record[0 : 4] not in (b"\x02\0\0\0", b"\0\0\0\x02"):
+            return None
+
+        datagram = record[4 : ]
+    else:
+        return None
+
+    if len(datagram) < 20 or (datagram[0] >> 4) != 4:
+        return None
+
+    return datagram
+
+# Reads pcap and pcapng capture files by mapping them into memory, so that
+# files larger than the available memory can be read, and without copying
+# any record. Use it as a context manager, or call "close" when done.
+#
+# NOTE: Records are memoryviews into the mapped file. If any of them is
+# still in use when the reader is closed, the file stays mapped until the
+# last of them is released (or garbage collected).
+class Reader:
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.map = None
+        self.data = memoryview(b"")
+
+        if self.file.seek(0, 2) != 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+            self.data = memoryview(self.map)
+
+            # The file is read from start to end once, so the OS can read
+            # ahead and drop the pages already read.
+            if hasattr(self.map, "madvise"):
+                self.map.madvise(mmap.MADV_SEQUENTIAL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        self.data.release()
+
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # Some records are still in use, and they keep the map alive.
+                # Dropping it here means it's unmapped as soon as they're
+                # released, rather than when the reader is collected.
+                pass
+
+            self.map = None
+
+        self.file.close()
+
+    # Yields every record as a (timestamp, data, link type) tuple, where
+    # the timestamp is in seconds.
+    def records(self):
+        if len(self.data) < 4:
+            return
+
+        magic = int.from_bytes(self.data[0 : 4], "little")
+
+        if magic == _pcapng_section_header_block:
+            yield from self._pcapng_records()
+        else:
+            yield from self._pcap_records()
+
+    # Yields every IPv4 datagram in the file, skipping records that carry
+    # anything else.
+    def datagrams(self):
+        for _, record, link_type in self.records():
+            datagram = _get_ipv4_datagram(record, link_type)
+
+            if datagram is not None:
+                yield datagram
+
+    # Same as "datagrams", but yields (timestamp, datagram) tuples.
+    def timestamped_datagrams(self):
+        for timestamp, record, link_type in self.records():
+            datagram = _get_ipv4_datagram(record, link_type)
+
+            if datagram is not None:
+                yield timestamp, datagram
+
+    def __iter__(self):
+        return self.datagrams()
+
+    def _pcap_records(self):
+        data = self.data
+
+        for byte_order in ("<", ">"):
+            magic, = struct.unpack_from(byte_order + "I", data, 0)
+
+            if magic in (_pcap_magic, _pcap_nanoseconds_magic):
+                break
+        else:
+            raise ValueError("Not a pcap nor a pcapng file")
+
+        resolution = 1e-9 if magic == _pcap_nanoseconds_magic else 1e-6
+
+        link_type, = struct.unpack_from(byte_order + "I", data, 20)
+        link_type &= 0xFFFF
+
+        record_header = struct.Struct(byte_order + "IIII")
+        offset = 24
+
+        while offset + record_header.size <= len(data):
+            seconds, fraction, captured_length, _ = record_header.unpack_from(data, offset)
+            offset += record_header.size
+
+            yield seconds + fraction * resolution, data[offset : offset + captured_length], link_type
+
+            offset += captured_length
+
+    def _pcapng_records(self):
+        data = self.data
+        offset = 0
+
+        # Link type and timestamp resolution of every interface of the
+        # current section.
+        interfaces = []
+        byte_order = "<"
+
+        while offset + 12 <= len(data):
+            block_type = int.from_bytes(data[offset : offset + 4], "little")
+
+            if block_type == _pcapng_section_header_block:
+                # The byte order magic tells the byte order of the section.
+                byte_order_magic = int.from_bytes(data[offset + 8 : offset + 12], "little")
+                byte_order = "<" if byte_order_magic == _pcapng_byte_order_magic else ">"
+                interfaces = []
+
+            block_type, block_length = struct.unpack_from(byte_order + "II", data, offset)
+
+            if block_length < 12:
+                raise ValueError("Invalid pcapng block at offset %d" % offset)
+
+            body = data[offset + 8 : offset + block_length - 4]
+
+            if block_type == _pcapng_interface_description_block:
+                link_type, = struct.unpack_from(byte_order + "H", body, 0)
+                interfaces.append((link_type, self._pcapng_resolution(body[8 : ], byte_order)))
+            elif block_type == _pcapng_enhanced_packet_block:
+                interface, high, low, captured_length, _ = struct.unpack_from(byte_order + "IIIII", body, 0)
+                link_type, resolution = interfaces[interface]
+
+                yield ((high << 32) | low) * resolution, body[20 : 20 + captured_length], link_type
+            elif block_type == _pcapng_simple_packet_block:
+                original_length, = struct.unpack_from(byte_order + "I", body, 0)
+                link_type, _ = interfaces[0]
+
+                yield 0.0, body[4 : 4 + original_length], link_type
+
+            offset += block_length
+
+    # Returns the timestamp resolution (in seconds) from the options of an
+    # interface description block, which defaults to microseconds.
+    @staticmethod
+    def _pcapng_resolution(options: memoryview, byte_order: str):
+        offset = 0
+
+        while offset + 4 <= len(options):
+            code, length = struct.unpack_from(byte_order + "HH", options, offset)
+
+            # "if_tsresol" option.
+            if code == 9 and length >= 1:
+                value = options[offset + 4]
+
+                if value & 0x80:
+                    return 2.0 ** -(value & 0x7F)
+
+                return 10.0 ** -value
+
+            if code == 0:
+                break
+
+            offset += 4 + length + (-length % 4)
+
+        return 1e-6
+
+# Writes (classic) pcap capture files, one record at a time, straight into
+# the file. Use it as a context manager, or call "close" when done.
+class Writer:
+    def __init__(self, path: str, link_type: int = LINKTYPE_RAW, snapshot_length: int = 0xFFFF):
+        self.file = open(path, "wb")
+        self.snapshot_length = snapshot_length
+
+        # Version 2.4, no time zone offset and no timestamp accuracy.
+        self.file.write(struct.pack("<IHHiIII", _pcap_magic, 2, 4, 0, 0, snapshot_length, link_type))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    # Records longer than the snapshot length are cut short, as if they had
+    # been captured that way, keeping their original length.
+    def write(self, record: bytes, timestamp: float = 0.0):
+        seconds = int(timestamp)
+        microseconds = int(round((timestamp - seconds) * 1e6))
+        captured_length = min(len(record), self.snapshot_length)
+
+        self.file.write(struct.pack("<IIII", seconds, microseconds, captured_length, len(record)))
+        self.file.write(record[0 : captured_length])
+
+# Copies the IPv4 datagrams accepted by "keep" (a function taking a
+# datagram) from one capture file into a new one, keeping their timestamps,
+# without holding either of them in memory. Returns the amount of datagrams
+# copied.
+def filter_capture(source_path: str, destination_path: str, keep):
+    count = 0
+
+    with Reader(source_path) as reader, Writer(destination_path) as writer:
+        for timestamp, record, link_type in reader.records():
+            datagram = _get_ipv4_datagram(record, link_type)
+
+            if datagram is not None and keep(datagram):
+                writer.write(datagram, timestamp)
+                count += 1
+
+    return count
@@ -0,0 +1,431 @@
+import ascii85
+import bitwise
+import multiprocessing
+import packet
+import parity
+import queue
+import threading
+import time
+import vm
+import xoring
+
+# Every stage has the same streaming interface as the layers' decoders (see
+# "ascii85.Decoder"): "feed" takes a chunk and returns whatever can be
+# decoded so far (maybe nothing), and "finish" returns whatever is left once
+# the input ends.
+
+# Extracts the ASCII85 payload (from "<~" to "~>", both included) of a layer,
+# dropping the text around it.
+class PayloadStage:
+    def __init__(self):
+        self.started = False
+        self.ended = False
+
+        # Bytes of the payload returned so far, so the leading guard is known
+        # even if it's split in two.
+        self.length = 0
+
+        # Last byte of the previous chunk, in case a guard is split in two.
+        self.carry = b""
+
+    def feed(self, chunk: bytes):
+        if self.ended:
+            return bytearray()
+
+        chunk = self.carry + bytes(chunk)
+        self.carry = b""
+
+        if not self.started:
+            start = chunk.find(b"<~")
+
+            if start == -1:
+                self.carry = chunk[-1 : ] if chunk[-1 : ] == b"<" else b""
+                return bytearray()
+
+            chunk = chunk[start : ]
+            self.started = True
+
+        # NOTE: The search starts after the leading guard, as "<~~>" is a
+        # valid (empty) payload but "<~>" is not.
+        end = chunk.find(b"~>", max(2 - self.length, 0))
+
+        if end != -1:
+            self.ended = True
+            return bytearray(chunk[0 : end + 2])
+
+        if chunk[-1 : ] == b"~":
+            self.carry = chunk[-1 : ]
+            chunk = chunk[0 : -1]
+
+        self.length += len(chunk)
+
+        return bytearray(chunk)
+
+    def finish(self):
+        byte_result, self.carry = bytearray(self.carry if self.started else b""), b""
+        self.ended = True
+
+        return byte_result
+
+class BitwiseStage:
+    def feed(self, chunk: bytes):
+        return bitwise.decode(chunk)
+
+    def finish(self):
+        return bytearray()
+
+class XoringStage:
+    def __init__(self, key: bytes = xoring.key):
+        self.key = key
+
+        # Position of the next chunk in the stream.
+        self.offset = 0
+
+    def feed(self, chunk: bytes):
+        byte_result = xoring.xor(chunk, self.key, self.offset)
+        self.offset += len(chunk)
+
+        return byte_result
+
+    def finish(self):
+        return bytearray()
+
+# Decodes the packets as they're completed, keeping the incomplete one for
+# the next chunk. Fragments are reassembled across chunks.
+class PacketStage:
+    def __init__(self, packet_filter: packet.PacketFilter = None):
+        self.packet_filter = packet_filter
+        self.reassembler = packet.Reassembler()
+        self.pending = bytearray()
+
+    def feed(self, chunk: bytes):
+        self.pending += chunk
+
+        offsets = packet.index_packets(self.pending, partial = True)
+
+        if len(offsets) == 0:
+            return bytearray()
+
+        # Where the last complete packet ends.
+        end = offsets[-1] + int.from_bytes(self.pending[offsets[-1] + 2 : offsets[-1] + 4], "big")
+
+        complete = memoryview(bytes(self.pending[0 : end]))
+        del self.pending[0 : end]
+
+        datagrams = (complete[start : stop] for start, stop in zip(offsets, list(offsets[1 : ]) + [end]))
+
+        return packet.decode_datagrams(datagrams, self.packet_filter, self.reassembler)
+
+    # An incomplete packet at the end is dropped, like an invalid one.
+    def finish(self):
+        self.pending = bytearray()
+
+        return bytearray()
+
+# The VM layer's payload is a program, which can't run until it's complete,
+# so it's only run once the input ends.
+class VMStage:
+    def __init__(self, jit: bool = True):
+        self.jit = jit
+        self.program = bytearray()
+
+    def feed(self, chunk: bytes):
+        self.program += chunk
+
+        return bytearray()
+
+    def finish(self):
+        program, self.program = self.program, bytearray()
+
+        return vm.VM(program, self.jit).run()
+
+# Stage factories by name. Stages in process pipelines must be created by
+# picklable factories (e.g. classes at the top level of a module).
+stages = {
+    "payload": PayloadStage,
+    "ascii85": ascii85.Decoder,
+    "bitwise": BitwiseStage,
+    "parity": parity.Decoder,
+    "xoring": XoringStage,
+    "packet": PacketStage,
+    "vm": VMStage,
+}
+
+def register_stage(name: str, factory):
+    stages[name] = factory
+
+# How much time a stage spent working, waiting for its input (starved) and
+# waiting for room in its output (back-pressure), and how much data it went
+# through.
+class StageStats:
+    __slots__ = ("name", "bytes_in", "bytes_out", "chunks_in", "chunks_out", "busy", "starved", "blocked")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.chunks_in = 0
+        self.chunks_out = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    # Bytes of input processed per second of work.
+    @property
+    def throughput(self):
+        return self.bytes_in / self.busy if self.busy != 0.0 else 0.0
+
+    def as_dict(self):
+        result = {name: getattr(self, name) for name in self.__slots__}
+        result["throughput"] = self.throughput
+
+        return result
+
+    # NOTE: Stats are sent back from worker processes, and classes with
+    # "__slots__" (and no "__dict__") need help to be pickled.
+    def __getstate__(self):
+        return self.as_dict()
+
+    def __setstate__(self, state):
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+# Wraps an exception raised by a stage, so that it reaches the end of the
+# pipeline (and is raised there) while stages keep draining their inputs.
+class _Failure:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+# Runs a stage until its input ends (with "None"), passing its output along.
+# Runs on its own thread or process. Once "cancelled" is set, the input is
+# only drained (see "Pipeline.run").
+def _run_stage(index: int, name: str, factory, input_queue, output_queue, stats_queue, cancelled):
+    stats = StageStats(name)
+    failure = None
+
+    def put(item):
+        started = time.perf_counter()
+        output_queue.put(item)
+        stats.blocked += time.perf_counter() - started
+
+    try:
+        stage = factory()
+    except Exception as exception:
+        failure = _Failure(exception)
+        put(failure)
+
+    while True:
+        started = time.perf_counter()
+        chunk = input_queue.get()
+        stats.starved += time.perf_counter() - started
+
+        if chunk is None:
+            break
+
+        # Keep draining the input after a failure, so earlier stages don't
+        # block forever.
+        if failure is not None or cancelled.is_set():
+            continue
+
+        if isinstance(chunk, _Failure):
+            failure = chunk
+            put(failure)
+            continue
+
+        stats.bytes_in += len(chunk)
+        stats.chunks_in += 1
+
+        started = time.perf_counter()
+
+        try:
+            byte_result = stage.feed(chunk)
+        except Exception as exception:
+            failure = _Failure(exception)
+            put(failure)
+            continue
+        finally:
+            stats.busy += time.perf_counter() - started
+
+        if len(byte_result) != 0:
+            stats.bytes_out += len(byte_result)
+            stats.chunks_out += 1
+            put(byte_result)
+
+    if failure is None and not cancelled.is_set():
+        started = time.perf_counter()
+
+        try:
+            byte_result = stage.finish()
+        except Exception as exception:
+            byte_result = _Failure(exception)
+        finally:
+            stats.busy += time.perf_counter() - started
+
+        if isinstance(byte_result, _Failure) or len(byte_result) != 0:
+            if not isinstance(byte_result, _Failure):
+                stats.bytes_out += len(byte_result)
+                stats.chunks_out += 1
+
+            put(byte_result)
+
+    put(None)
+    stats_queue.put((index, stats))
+
+# Feeds the chunks into the first stage, until they end or "cancelled" is
+# set. Runs on its own thread.
+def _feed(chunks, output_queue, cancelled):
+    try:
+        for chunk in chunks:
+            if cancelled.is_set():
+                break
+
+            if len(chunk) != 0:
+                output_queue.put(chunk)
+    except Exception as exception:
+        output_queue.put(_Failure(exception))
+
+    output_queue.put(None)
+
+# Stops a run that's still going: the feeder stops reading chunks, and
+# stages stop working and only drain their inputs. "queues" (the output of
+# the last stage, and the stats queue) are emptied until every stage is
+# done, so none stays blocked on a full queue.
+#
+# NOTE: The queues between stages must be left alone, or the "None" that
+# ends a stage's input could be taken from it.
+def _cancel(cancelled, feeder, workers, queues):
+    cancelled.set()
+
+    while feeder.is_alive() or any(worker.is_alive() for worker in workers):
+        for item_queue in queues:
+            try:
+                while True:
+                    item_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+        time.sleep(0.001)
+
+    feeder.join()
+
+    for worker in workers:
+        worker.join()
+
+# Decodes data through a sequence of stages (names in "stages" or
+# factories), each running on its own thread (or process, if "processes"
+# is set) and connected to the next one by a queue of at most
+# "queue_length" chunks. Stages start as soon as the previous one outputs
+# anything, and a full queue stops the stage before it until there's room,
+# so memory use is bounded and the total time approaches that of the
+# slowest stage.
+#
+# NOTE: Threads share the interpreter, so stages only run in parallel while
+# they're in code that releases it (e.g. NumPy). Processes always do, at the
+# cost of copying every chunk between them.
+class Pipeline:
+    def __init__(self, stage_names, queue_length: int = 8, processes: bool = False,
+                 chunk_length: int = 1024 * 1024):
+        self.stage_names = [name if isinstance(name, str) else getattr(name, "__name__", repr(name))
+                            for name in stage_names]
+        self.factories = [stages[name] if isinstance(name, str) else name for name in stage_names]
+        self.queue_length = queue_length
+        self.processes = processes
+        self.chunk_length = chunk_length
+
+        # Stats of every stage in the last run (see "report").
+        self.stats = []
+        self.elapsed = 0.0
+
+    # Runs the chunks through every stage, yielding the last stage's output
+    # as soon as it's available. Exceptions raised by stages are raised
+    # here, once every stage is done.
+    #
+    # If the caller stops early (e.g. with "break", or by closing the
+    # generator), the run is cancelled, and every stage stops before this
+    # returns.
+    def run(self, chunks):
+        if self.processes:
+            new_queue = lambda: multiprocessing.Queue(self.queue_length)
+            new_worker = multiprocessing.Process
+            stats_queue = multiprocessing.Queue()
+            cancelled = multiprocessing.Event()
+        else:
+            new_queue = lambda: queue.Queue(self.queue_length)
+            new_worker = threading.Thread
+            stats_queue = queue.Queue()
+            cancelled = threading.Event()
+
+        queues = [new_queue() for _ in range(len(self.factories) + 1)]
+
+        workers = [new_worker(target = _run_stage, daemon = True,
+                              args = (i, self.stage_names[i], factory, queues[i], queues[i + 1], stats_queue,
+                                      cancelled))
+                   for i, factory in enumerate(self.factories)]
+
+        feeder = threading.Thread(target = _feed, args = (chunks, queues[0], cancelled), daemon = True)
+
+        started = time.perf_counter()
+
+        for worker in workers:
+            worker.start()
+
+        feeder.start()
+
+        failure = None
+
+        try:
+            while True:
+                byte_result = queues[-1].get()
+
+                if byte_result is None:
+                    break
+
+                if isinstance(byte_result, _Failure):
+                    failure = failure or byte_result
+                    continue
+
+                if failure is None:
+                    yield byte_result
+        except BaseException:
+            _cancel(cancelled, feeder, workers, [queues[-1], stats_queue])
+            raise
+
+        stats = [stats_queue.get() for _ in workers]
+
+        feeder.join()
+
+        for worker in workers:
+            worker.join()
+
+        self.elapsed = time.perf_counter() - started
+        self.stats = [stage_stats for _, stage_stats in sorted(stats, key = lambda item: item[0])]
+
+        if failure is not None:
+            raise failure.exception
+
+    # Same as "run", but for a whole buffer, which is split in chunks of
+    # "chunk_length" bytes.
+    def decode(self, byte_data: bytes):
+        byte_data = memoryview(byte_data)
+        chunks = (bytes(byte_data[i : i + self.chunk_length]) for i in range(0, len(byte_data), self.chunk_length))
+
+        byte_result = bytearray()
+
+        for chunk in self.run(chunks):
+            byte_result += chunk
+
+        return byte_result
+
+    # Returns the stats of the last run as text, one stage per line.
+    def report(self):
+        lines = ["%-10s %10s %10s %12s %8s %8s %8s" % ("stage", "in (KB)", "out (KB)", "MB/s", "busy", "starved",
+                                                     "blocked")]
+
+        for stats in self.stats:
+            lines.append("%-10s %10d %10d %12.1f %7.3fs %7.3fs %7.3fs"
+                         % (stats.name, stats.bytes_in // 1024, stats.bytes_out // 1024,
+                            stats.throughput / (1024 * 1024), stats.busy, stats.starved, stats.blocked))
+
+        lines.append("total: %.3fs" % self.elapsed)
+
+        return "\n".join(lines)
@@ -1,5 +1,7 @@
+import array
 import ascii85
 import base64
+import random
 import unittest
 
 # NOTE: Proper str.encode() calls have been added to convert "str" objects into "bytes" objects.
@@ -36,3 +38,70 @@ class TestASCII85(unittest.TestCase):
             expected = base64.a85decode(phrase, adobe = True)
 
             self.assertEqual(actual, expected)
+
+    def test_decode_bulk(self):
+        # Random data with zero blocks (encoded as "z") and line breaks.
+        generator = random.Random(85)
+        data = bytes(generator.getrandbits(8) for _ in range(4099)) + bytes(8) + b"onion"
+        phrase = base64.a85encode(data, adobe = True, wrapcol = 76)
+
+        expected = base64.a85decode(phrase, adobe = True)
+
+        self.assertEqual(ascii85.decode(phrase), expected)
+
+        # Force the pure-Python path.
+        numpy, ascii85.numpy = ascii85.numpy, None
+
+        try:
+            self.assertEqual(ascii85.decode(phrase), expected)
+        finally:
+            ascii85.numpy = numpy
+
+    def test_decode_stream(self):
+        for phrase in self.phrases_to_decode:
+            phrase = phrase.encode("utf-8")
+
+            # Feed one character at a time, so that both guards and every
+            # block are split across chunks.
+            chunks = [phrase[i : i + 1] for i in range(len(phrase))]
+
+            actual = b"".join(ascii85.decode_stream(chunks))
+            expected = base64.a85decode(phrase, adobe = True)
+
+            self.assertEqual(actual, expected)
+
+    def test_decode_parallel(self):
+        phrase = base64.a85encode(bytes(range(256)) * 64 + bytes(9), adobe = True, wrapcol = 76)
+
+        # A zero threshold forces the process pool even for small inputs.
+        actual = ascii85.decode_parallel(phrase, workers = 2, threshold = 0)
+        expected = base64.a85decode(phrase, adobe = True)
+
+        self.assertEqual(actual, expected)
+
+    def test_encode_bulk(self):
+        # Zero blocks, including a trailing incomplete one which must not
+        # be folded into "z".
+        generator = random.Random(4)
+        phrase = bytes(8) + bytes(generator.getrandbits(8) for _ in range(4097)) + bytes(3)
+
+        # Blocks ending and starting with "!", which must not be taken for a
+        # zero-block ("!!\"!!" followed by "!!!!\"").
+        phrase = (7225).to_bytes(4, "big") + (1).to_bytes(4, "big") + phrase
+
+        expected = base64.a85encode(phrase, adobe = True)
+
+        self.assertEqual(ascii85.encode(phrase), expected)
+
+        # Force the pure-Python path.
+        numpy, ascii85.numpy = ascii85.numpy, None
+
+        try:
+            self.assertEqual(ascii85.encode(phrase), expected)
+        finally:
+            ascii85.numpy = numpy
+
+        # Any buffer is encoded as its bytes.
+        self.assertEqual(ascii85.encode(memoryview(phrase)), expected)
+        self.assertEqual(ascii85.encode(array.array("I", b"Four byte words!")),
+                         base64.a85encode(b"Four byte words!", adobe = True))
@@ -41,3 +41,13 @@ class TestBitwise(unittest.TestCase):
             actual = bitwise.decode(actual)
 
             self.assertEqual(actual, expected)
+
+    def test_round_trip(self):
+        every_byte = bytes(range(256))
+
+        for character in every_byte:
+            self.assertEqual(bitwise.decode_byte(bitwise.encode_byte(character)), character)
+
+        self.assertEqual(bitwise.decode(bitwise.encode(every_byte)), every_byte)
+        self.assertEqual(bitwise.encode(every_byte), bytes(map(bitwise.encode_byte, every_byte)))
+        self.assertEqual(bitwise.decode(every_byte), bytes(map(bitwise.decode_byte, every_byte)))
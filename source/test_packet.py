@@ -0,0 +1,223 @@
+import packet
+import random
+import unittest
+
+# Returns the ones' complement of the ones' complement sum of 16-bit words.
+def internet_checksum(byte_data: bytes):
+    if len(byte_data) % 2 != 0:
+        byte_data += b"\0"
+
+    checksum = sum(int.from_bytes(byte_data[i : i + 2], "big") for i in range(0, len(byte_data), 2))
+
+    while checksum > 0xFFFF:
+        checksum = (checksum & 0xFFFF) + (checksum >> 16)
+
+    return checksum ^ 0xFFFF
+
+# Builds an IPv4 + UDP packet, with valid checksums unless told otherwise.
+def build_packet(udp_data: bytes, source = bytes([10, 1, 1, 10]), destination = bytes([10, 1, 1, 200]),
+                 destination_port = 42069, valid_ipv4 = True, valid_udp = True):
+    udp_length = 8 + len(udp_data)
+
+    ipv4_header = bytearray([0x45, 0, 0, 0, 0, 1, 0, 0, 64, 17, 0, 0])
+    ipv4_header[2 : 4] = (20 + udp_length).to_bytes(2, "big")
+    ipv4_header += source + destination
+    ipv4_header[10 : 12] = (internet_checksum(bytes(ipv4_header)) ^ (not valid_ipv4)).to_bytes(2, "big")
+
+    udp_header = bytearray()
+    udp_header += (1234).to_bytes(2, "big") + destination_port.to_bytes(2, "big")
+    udp_header += udp_length.to_bytes(2, "big") + bytes(2)
+
+    pseudo_header = source + destination + (17).to_bytes(2, "big") + udp_length.to_bytes(2, "big")
+    udp_checksum = internet_checksum(pseudo_header + bytes(udp_header) + udp_data) ^ (not valid_udp)
+    udp_header[6 : 8] = udp_checksum.to_bytes(2, "big")
+
+    return bytes(ipv4_header + udp_header) + udp_data
+
+# Builds a fragment of "datagram" with the "fragment_data" at "start" (in
+# bytes, from the start of its data), keeping its IPv4 header.
+def build_fragment(datagram: bytes, start: int, fragment_data: bytes, more_fragments: bool):
+    header = bytearray(datagram[0 : 20])
+    header[2 : 4] = (20 + len(fragment_data)).to_bytes(2, "big")
+    header[6 : 8] = ((more_fragments << 13) | (start // 8)).to_bytes(2, "big")
+    header[10 : 12] = bytes(2)
+    header[10 : 12] = internet_checksum(bytes(header)).to_bytes(2, "big")
+
+    return bytes(header) + fragment_data
+
+# Splits "datagram" into fragments carrying "length" bytes of data each.
+def build_fragments(datagram: bytes, length: int = 16):
+    payload = datagram[20 : ]
+
+    return [build_fragment(datagram, start, payload[start : start + length], start + length < len(payload))
+            for start in range(0, len(payload), length)]
+
+class TestPacket(unittest.TestCase):
+
+    def setUp(self):
+        self.byte_data = b"".join([
+            build_packet(b"Hello, "),
+            build_packet(b"not me", valid_ipv4 = False),
+            build_packet(b"nor me", valid_udp = False),
+            build_packet(b"how are "),
+            build_packet(b"wrong source", source = bytes([10, 1, 1, 11])),
+            build_packet(b"wrong port", destination_port = 42070),
+            build_packet(b"you?"),
+        ])
+
+    def test_headers(self):
+        ipv4_header = packet.IPv4Header.from_bytes(self.byte_data)
+        udp_header = packet.UDPHeader.from_bytes(self.byte_data, 20)
+
+        self.assertEqual(ipv4_header.total_length, 35)
+        self.assertEqual(ipv4_header.protocol, 17)
+        self.assertEqual(ipv4_header.source_address, 0x0A01010A)
+        self.assertEqual(udp_header.destination_port, 42069)
+        self.assertEqual(udp_header.length, 15)
+
+    def test_decode(self):
+        self.assertEqual(packet.decode(self.byte_data), b"Hello, how are you?")
+
+    def test_index_packets(self):
+        offsets = packet.index_packets(self.byte_data)
+
+        self.assertEqual(list(offsets), [0, 35, 69, 103, 139, 179, 217])
+
+        # Offsets past 4 GiB must fit.
+        self.assertGreaterEqual(offsets.itemsize, 8)
+
+    def test_checksum(self):
+        byte_data = bytes(range(1, 200))
+
+        # Odd length, with a sum large enough to carry more than once.
+        checksum = internet_checksum(byte_data)
+
+        self.assertEqual(packet.ones_complement_sum(byte_data) ^ 0xFFFF, checksum)
+        self.assertTrue(packet.verify_checksum(byte_data + bytes([0]) + checksum.to_bytes(2, "big")))
+
+        # Replace the first word and update the checksum incrementally.
+        updated_data = bytes([0xAB, 0xCD]) + byte_data[2 : ]
+        updated_checksum = packet.update_checksum(checksum, 0x0102, 0xABCD)
+
+        self.assertEqual(updated_checksum, internet_checksum(updated_data))
+
+    def test_decode_parallel(self):
+        # A zero threshold forces the process pool even for small inputs.
+        actual = packet.decode_parallel(self.byte_data, workers = 2, threshold = 0)
+
+        self.assertEqual(actual, b"Hello, how are you?")
+
+    def test_filter(self):
+        packet_filter = packet.PacketFilter([
+            packet.Rule("10.1.1.0/24", "10.1.1.200", destination_ports = (42069, 42070), protocol = 17),
+        ])
+
+        actual = packet.decode(self.byte_data, packet_filter)
+
+        self.assertEqual(actual, b"Hello, how are wrong sourcewrong portyou?")
+
+        # Exact rules are looked up in a set, rather than compiled.
+        packet_filter = packet.PacketFilter([
+            packet.Rule("10.1.1.%d" % i, "10.1.1.200", destination_ports = 42069) for i in range(1, 255)
+        ])
+
+        self.assertNotIn("10.1.1", packet_filter.code)
+        self.assertEqual(packet.decode(self.byte_data, packet_filter), b"Hello, how are wrong sourceyou?")
+
+        # So are ranges, through sorted intervals, rather than checked one
+        # rule at a time.
+        rules = [packet.Rule("10.%d.0.0/16" % i, destination_ports = (100 * i, 100 * i + 149),
+                             protocol = 17 if i % 2 else None)
+                 for i in range(1, 100)]
+
+        packet_filter = packet.PacketFilter(rules)
+        rule_ranges = [(rule.ranges(), rule.protocol) for rule in rules]
+        generator = random.Random(0)
+        accepted = 0
+
+        self.assertNotIn("10.", packet_filter.code)
+
+        for _ in range(2000):
+            source_address = 0x0A000000 | (generator.randrange(102) << 16) | generator.randrange(0x10000)
+            destination_port = generator.randrange(10100)
+            protocol = generator.choice((6, 17))
+
+            expected = any(ranges[0][0] <= source_address <= ranges[0][1]
+                           and ranges[3][0] <= destination_port <= ranges[3][1]
+                           and rule_protocol in (None, protocol) for ranges, rule_protocol in rule_ranges)
+
+            self.assertEqual(packet_filter.accepts(source_address, 0, protocol, 0, destination_port), expected)
+            accepted += expected
+
+        self.assertTrue(0 < accepted < 2000)
+
+    def test_options(self):
+        # Add 4 bytes of options (3 NOPs and an end of options list).
+        datagram = bytearray(build_packet(b"Options"))
+        datagram[0] = 0x46
+        datagram[2 : 4] = (len(datagram) + 4).to_bytes(2, "big")
+        datagram[10 : 12] = bytes(2)
+        datagram[20 : 20] = bytes([1, 1, 1, 0])
+        datagram[10 : 12] = internet_checksum(bytes(datagram[0 : 24])).to_bytes(2, "big")
+
+        ipv4_header = packet.IPv4Header.from_bytes(datagram)
+
+        self.assertEqual(ipv4_header.version, 4)
+        self.assertEqual(ipv4_header.header_length, 24)
+        self.assertEqual(bytes(ipv4_header.options), bytes([1, 1, 1, 0]))
+        self.assertEqual(packet.decode(bytes(datagram)), b"Options")
+
+    def test_fragments(self):
+        datagram = build_packet(b"Fragmented data, in three pieces.")
+        fragments = build_fragments(datagram)
+
+        ipv4_header = packet.IPv4Header.from_bytes(fragments[0])
+
+        self.assertTrue(ipv4_header.is_fragment)
+        self.assertEqual(ipv4_header.flags, packet.IPv4Header.MORE_FRAGMENTS)
+
+        # Fragments arriving out of order, between other packets.
+        byte_data = fragments[2] + self.byte_data + fragments[0] + fragments[1]
+
+        self.assertEqual(packet.decode(byte_data), b"Hello, how are you?Fragmented data, in three pieces.")
+
+        # The process pool can't reassemble fragments, so it doesn't try.
+        self.assertEqual(packet.decode_parallel(byte_data, workers = 2, threshold = 0),
+                         b"Hello, how are you?Fragmented data, in three pieces.")
+
+    def test_malformed_fragments(self):
+        datagram = build_packet(bytes(range(48)))
+        payload = datagram[20 : ]
+        fragments = build_fragments(datagram)
+
+        # A fragment past the end of the datagram drops it.
+        past_end = build_fragment(datagram, 64, b"past the end", False)
+        self.assertEqual(packet.decode(b"".join(fragments[0 : 3] + [past_end, fragments[3]])), b"")
+
+        # So does a last fragment ending before data already received.
+        early_end = build_fragment(datagram, 16, payload[16 : 24], False)
+        self.assertEqual(packet.decode(b"".join(fragments[0 : 3] + [early_end, fragments[3]])), b"")
+
+        # Overlapping fragments are fine as long as they agree.
+        overlapping = build_fragment(datagram, 8, payload[8 : 40], True)
+        self.assertEqual(packet.decode(b"".join([fragments[2], overlapping, fragments[0], fragments[3]])),
+                         bytes(range(48)))
+
+        # Fragments with an IHL under 5 are rejected, rather than read as
+        # if their data started inside their header.
+        short_header = bytearray(fragments[3])
+        short_header[0] = 0x44
+
+        reassembler = packet.Reassembler()
+
+        for fragment in fragments[0 : 3] + [bytes(short_header)]:
+            self.assertIsNone(reassembler.add(packet.IPv4Header.from_bytes(fragment), fragment, 0.0))
+
+        self.assertEqual(reassembler.add(packet.IPv4Header.from_bytes(fragments[3]), fragments[3], 0.0),
+                         datagram)
+
+        # Non-fragmented packets with an IHL under 5 are dropped too.
+        short_header = bytearray(build_packet(b"short"))
+        short_header[0] = 0x44
+
+        self.assertEqual(packet.decode(bytes(short_header) + build_packet(b"fine")), b"fine")
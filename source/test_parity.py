@@ -0,0 +1,49 @@
+import parity
+import unittest
+
+class TestParity(unittest.TestCase):
+
+    def setUp(self):
+        self.phrase = b"Hello, how are you? I'm fine."
+
+        # Split the phrase into 7-bit values, and add the parity bit to each
+        # one. Every third byte gets a wrong parity bit, and is then
+        # followed by its valid version.
+        bits = int.from_bytes(self.phrase, "big")
+        bit_count = len(self.phrase) * 8
+
+        self.byte_data = bytearray()
+
+        for i in range(0, bit_count // 7):
+            value = (bits >> (bit_count - 7 * (i + 1))) & 0b1111111
+            byte = (value << 1) | (bin(value).count("1") % 2)
+
+            if i % 3 == 0:
+                self.byte_data.append(byte ^ 1)
+
+            self.byte_data.append(byte)
+
+    def test_decode(self):
+        # Bits that do not make up a whole byte at the end are lost.
+        expected = self.phrase[0 : len(self.phrase) * 8 // 7 * 7 // 8]
+
+        self.assertEqual(parity.decode(self.byte_data), expected)
+
+        # Force the pure-Python path.
+        numpy, parity.numpy = parity.numpy, None
+
+        try:
+            self.assertEqual(parity.decode(self.byte_data), expected)
+        finally:
+            parity.numpy = numpy
+
+    def test_decode_stream(self):
+        expected = parity.decode(self.byte_data)
+
+        # Chunks of different sizes, so that the bits left over vary.
+        for size in range(1, 10):
+            chunks = [self.byte_data[i : i + size] for i in range(0, len(self.byte_data), size)]
+
+            actual = b"".join(parity.decode_stream(chunks))
+
+            self.assertEqual(actual, expected)
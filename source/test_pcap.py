@@ -0,0 +1,156 @@
+import os
+import packet
+import pcap
+import struct
+import tempfile
+import unittest
+import weakref
+
+class TestPcap(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+        source_address = 0x0A01010A # 10.1.1.10
+        destination_address = 0x0A0101C8 # 10.1.1.200
+
+        self.datagrams = [
+            packet.build_udp_packet(b"Hello, ", source_address, destination_address, 1234, 42069),
+            packet.build_udp_packet(b"not me", source_address, destination_address, 1234, 42070),
+            packet.build_udp_packet(b"world!", source_address, destination_address, 1234, 42069),
+        ]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_pcap(self):
+        path = os.path.join(self.directory.name, "capture.pcap")
+
+        with pcap.Writer(path) as writer:
+            for i, datagram in enumerate(self.datagrams):
+                writer.write(datagram, 1.5 * i)
+
+        with pcap.Reader(path) as reader:
+            timestamps = [timestamp for timestamp, _, _ in reader.records()]
+            actual = packet.decode_datagrams(reader)
+
+        self.assertEqual(timestamps, [0.0, 1.5, 3.0])
+        self.assertEqual(actual, b"Hello, world!")
+
+        # Keep the second datagram only.
+        filtered_path = os.path.join(self.directory.name, "filtered.pcap")
+        count = pcap.filter_capture(path, filtered_path, lambda datagram: datagram[23] == 0x56)
+
+        with pcap.Reader(filtered_path) as reader:
+            self.assertEqual(count, 1)
+            self.assertEqual([bytes(d) for d in reader], [self.datagrams[1]])
+
+    def test_snapshot_length(self):
+        path = os.path.join(self.directory.name, "capture.pcap")
+
+        with pcap.Writer(path, snapshot_length = 24) as writer:
+            writer.write(self.datagrams[0])
+
+        with open(path, "rb") as file:
+            _, _, captured_length, original_length = struct.unpack_from("<IIII", file.read(), 24)
+
+        self.assertEqual((captured_length, original_length), (24, len(self.datagrams[0])))
+
+        with pcap.Reader(path) as reader:
+            self.assertEqual([bytes(record) for _, record, _ in reader.records()], [self.datagrams[0][0 : 24]])
+
+    def test_close(self):
+        path = os.path.join(self.directory.name, "capture.pcap")
+
+        with pcap.Writer(path) as writer:
+            writer.write(self.datagrams[0])
+
+        # Records still in use keep the file mapped, until they're released.
+        with pcap.Reader(path) as reader:
+            record = next(reader.datagrams())
+            mapped_file = weakref.ref(reader.map)
+
+        self.assertEqual(bytes(record), self.datagrams[0])
+        self.assertIsNotNone(mapped_file())
+
+        record.release()
+
+        self.assertIsNone(mapped_file())
+
+    def test_non_udp(self):
+        path = os.path.join(self.directory.name, "capture.pcap")
+
+        # A header only ICMP datagram (protocol 1), and UDP datagrams cut
+        # short by the capture, in the middle of their IPv4 and UDP headers.
+        icmp_datagram = bytearray(self.datagrams[0][0 : 20])
+        icmp_datagram[2 : 4] = (20).to_bytes(2, "big")
+        icmp_datagram[9] = 1
+
+        with pcap.Writer(path) as writer:
+            writer.write(bytes(icmp_datagram))
+            writer.write(self.datagrams[0][0 : 12])
+            writer.write(self.datagrams[0][0 : 24])
+            writer.write(self.datagrams[2])
+
+        with pcap.Reader(path) as reader:
+            self.assertEqual(packet.decode_datagrams(reader), b"world!")
+
+        self.assertEqual(packet.decode(bytes(icmp_datagram) + self.datagrams[2]), b"world!")
+
+    def test_fragment_timeout(self):
+        path = os.path.join(self.directory.name, "capture.pcap")
+        datagram = self.datagrams[2]
+
+        # Split the datagram in two fragments, the first one carrying the UDP
+        # header (8 bytes) and setting the "more fragments" flag.
+        fragments = []
+
+        for start, end, fragment_fields in ((20, 28, 0x2000), (28, len(datagram), 0x0001)):
+            header = bytearray(datagram[0 : 20])
+            header[2 : 4] = (20 + end - start).to_bytes(2, "big")
+            header[6 : 8] = fragment_fields.to_bytes(2, "big")
+            header[10 : 12] = bytes(2)
+            header[10 : 12] = (packet.ones_complement_sum(header) ^ 0xFFFF).to_bytes(2, "big")
+
+            fragments.append(bytes(header) + datagram[start : end])
+
+        # Fragments expire by the capture's timestamps, however fast the
+        # capture is read.
+        for delay, expected in ((1.0, b"world!"), (60.0, b"")):
+            with pcap.Writer(path) as writer:
+                writer.write(fragments[0], 0.0)
+                writer.write(fragments[1], delay)
+
+            with pcap.Reader(path) as reader:
+                self.assertEqual(packet.decode_datagrams(reader), expected)
+
+    def test_pcapng(self):
+        path = os.path.join(self.directory.name, "capture.pcapng")
+
+        # Section header, Ethernet interface (with nanosecond timestamps) and
+        # one enhanced packet block per datagram.
+        blocks = [struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)]
+        block_types = [0x0A0D0D0A]
+
+        blocks.append(struct.pack("<HHIHHB3xHH", pcap.LINKTYPE_ETHERNET, 0, 0xFFFF, 9, 1, 9, 0, 0))
+        block_types.append(1)
+
+        for i, datagram in enumerate(self.datagrams):
+            frame = bytes(12) + b"\x08\x00" + datagram
+            frame += bytes(-len(frame) % 4)
+            blocks.append(struct.pack("<IIIII", 0, 0, i * 1000, len(datagram) + 14, len(datagram) + 14) + frame)
+            block_types.append(6)
+
+        with open(path, "wb") as file:
+            for block_type, body in zip(block_types, blocks):
+                file.write(struct.pack("<II", block_type, len(body) + 12) + body + struct.pack("<I", len(body) + 12))
+
+        with pcap.Reader(path) as reader:
+            timestamps = [timestamp for timestamp, _, _ in reader.records()]
+            actual = packet.decode_datagrams(reader)
+
+        for actual_timestamp, expected_timestamp in zip(timestamps, [0.0, 1e-6, 2e-6]):
+            self.assertAlmostEqual(actual_timestamp, expected_timestamp)
+
+        self.assertEqual(len(timestamps), 3)
+        self.assertEqual(actual, b"Hello, world!")
@@ -0,0 +1,98 @@
+import ascii85
+import bitwise
+import itertools
+import multiprocessing
+import packet
+import pipeline
+import threading
+import unittest
+import xoring
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.phrase = b"Hello, how are you? I'm fine. " * 100
+
+        # A layer as found in the onion: instructions, and the payload.
+        self.onion = b"==[ Layer 1 ]==\n\nFlip every second bit.\n\n"
+        self.onion += ascii85.encode(bitwise.encode(xoring.xor(self.phrase, xoring.key)))
+        self.onion += b"\n"
+
+    def test_decode(self):
+        for processes in (False, True):
+            for chunk_length in (1, 7, 1024):
+                engine = pipeline.Pipeline(["payload", "ascii85", "bitwise", "xoring"], queue_length = 2,
+                                           processes = processes, chunk_length = chunk_length)
+
+                self.assertEqual(engine.decode(self.onion), self.phrase)
+
+                self.assertEqual([stats.name for stats in engine.stats], ["payload", "ascii85", "bitwise", "xoring"])
+                self.assertEqual(engine.stats[0].bytes_in, len(self.onion))
+                self.assertEqual(engine.stats[-1].bytes_out, len(self.phrase))
+
+                for stats, next_stats in zip(engine.stats, engine.stats[1 : ]):
+                    self.assertEqual(stats.bytes_out, next_stats.bytes_in)
+
+    def test_payload(self):
+        stage = pipeline.PayloadStage()
+        byte_result = bytearray()
+
+        for i in range(len(self.onion)):
+            byte_result += stage.feed(self.onion[i : i + 1])
+
+        byte_result += stage.finish()
+
+        self.assertEqual(byte_result, self.onion[self.onion.index(b"<~") : self.onion.index(b"~>") + 2])
+
+        # "<~>" doesn't end the payload, even if the guards arrive apart.
+        for chunks in ([b"<~", b">abc~>"], [b"<", b"~", b">abc~", b">"]):
+            stage = pipeline.PayloadStage()
+            byte_result = bytearray()
+
+            for chunk in chunks:
+                byte_result += stage.feed(chunk)
+
+            self.assertEqual(byte_result + stage.finish(), b"<~>abc~>")
+
+    def test_packet(self):
+        source_address = 0x0A01010A # 10.1.1.10
+        destination_address = 0x0A0101C8 # 10.1.1.200
+
+        byte_data = b"".join(packet.build_udp_packet(bytes([i]) * i, source_address, destination_address,
+                                                     1234, 42069)
+                             for i in range(1, 50))
+
+        engine = pipeline.Pipeline(["packet"], chunk_length = 13)
+
+        self.assertEqual(engine.decode(byte_data), packet.decode(byte_data))
+
+    def test_vm(self):
+        # MVI a <- "H", OUT, MVI a <- "i", OUT, HALT.
+        program = bytes([0x48, 0x48, 0x02, 0x48, 0x69, 0x02, 0x01])
+
+        engine = pipeline.Pipeline(["payload", "ascii85", "vm"], chunk_length = 3)
+
+        self.assertEqual(engine.decode(b"Run this: " + ascii85.encode(program)), b"Hi")
+
+    def test_failure(self):
+        # A packet with a total length of 0.
+        engine = pipeline.Pipeline(["bitwise", "packet", "xoring"], queue_length = 1, chunk_length = 1)
+
+        with self.assertRaises(ValueError):
+            engine.decode(bitwise.encode(bytes(1000)))
+
+        self.assertEqual(len(engine.stats), 3)
+
+    def test_abandon(self):
+        thread_count = threading.active_count()
+
+        for processes in (False, True):
+            engine = pipeline.Pipeline(["bitwise", "xoring"], queue_length = 1, processes = processes)
+
+            # The input never ends, and every queue is full by the time the
+            # run is abandoned.
+            for _ in engine.run(itertools.repeat(b"abc")):
+                break
+
+            self.assertEqual(threading.active_count(), thread_count)
+            self.assertEqual(multiprocessing.active_children(), [])
@@ -0,0 +1,33 @@
+import bitwise
+import transform
+import unittest
+import xoring
+
+class TestTransform(unittest.TestCase):
+
+    def setUp(self):
+        self.byte_data = bytes(range(256)) * 5 + b"onion"
+
+        self.bitwise_decode = transform.ByteTransform.from_table(bitwise.decode_table)
+        self.xoring_decode = transform.ByteTransform.from_xor_key(xoring.key)
+
+    def test_fuse(self):
+        fused = transform.fuse(self.bitwise_decode, self.xoring_decode, self.bitwise_decode)
+
+        actual = fused.apply(self.byte_data)
+        expected = bitwise.decode(xoring.decode(bitwise.decode(self.byte_data)))
+
+        self.assertEqual(fused.period, 32)
+        self.assertEqual(actual, expected)
+
+    def test_offset(self):
+        expected = xoring.decode(self.byte_data)
+
+        # Transform the data in chunks which do not start at the key's
+        # first byte.
+        actual = bytearray()
+
+        for i in range(0, len(self.byte_data), 45):
+            actual += self.xoring_decode.apply(self.byte_data[i : i + 45], i)
+
+        self.assertEqual(actual, expected)
@@ -0,0 +1,312 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+import vm
+import vm_disassembler
+import vm_memory
+import vm_peephole
+import vm_profiler
+import vm_samples
+
+class TestVM(unittest.TestCase):
+
+    def setUp(self):
+        # Sample program from the layer's specification.
+        self.hello_world = bytes([
+            0x50, 0x48, 0xC2, 0x02, 0xA8, 0x4D, 0x00, 0x00, 0x00, 0x4F, 0x02, 0x50,
+            0x09, 0xC4, 0x02, 0x02, 0xE1, 0x01, 0x4F, 0x02, 0xC1, 0x22, 0x1D, 0x00,
+            0x00, 0x00, 0x48, 0x30, 0x02, 0x58, 0x03, 0x4F, 0x02, 0xB0, 0x29, 0x00,
+            0x00, 0x00, 0x48, 0x31, 0x02, 0x50, 0x0C, 0xC3, 0x02, 0xAA, 0x57, 0x48,
+            0x02, 0xC1, 0x21, 0x3A, 0x00, 0x00, 0x00, 0x48, 0x32, 0x02, 0x48, 0x77,
+            0x02, 0x48, 0x6F, 0x02, 0x48, 0x72, 0x02, 0x48, 0x6C, 0x02, 0x48, 0x64,
+            0x02, 0x48, 0x21, 0x02, 0x01, 0x65, 0x6F, 0x33, 0x34, 0x2C,
+        ])
+
+        # Outputs the immediate of its MVI instruction at address 14 three
+        # times, increasing it (in memory) each time.
+        self.self_modifying = bytes([
+            0xA8, 0x0F, 0x00, 0x00, 0x00, # MVI32 ptr <- 15
+            0x58, 0x00,                   # MVI c <- 0
+            0x60, 0x03,                   # MVI d <- 3
+            0xB0, 0x0E, 0x00, 0x00, 0x00, # MVI32 pc <- 14
+            0x48, 0x58,                   # MVI a <- 'X'
+            0x02,                         # OUT a
+            0x4F,                         # MV a <- (ptr+c)
+            0x50, 0x01,                   # MVI b <- 1
+            0xC2,                         # ADD a <- b
+            0x79,                         # MV (ptr+c) <- a
+            0x4C,                         # MV a <- d
+            0x50, 0x01,                   # MVI b <- 1
+            0xC3,                         # SUB a <- b
+            0x61,                         # MV d <- a
+            0x50, 0x00,                   # MVI b <- 0
+            0xC1,                         # CMP
+            0x22, 0x0E, 0x00, 0x00, 0x00, # JNZ 14
+            0x01,                         # HALT
+        ])
+
+    def test_run(self):
+        self.assertEqual(vm.VM(bytearray(self.hello_world)).run(), b"Hello, world!")
+
+    def test_next(self):
+        machine = vm.VM(bytearray(self.hello_world))
+        output = bytearray()
+
+        while machine.next(output):
+            pass
+
+        self.assertEqual(output, b"Hello, world!")
+
+    def test_self_modifying(self):
+        self.assertEqual(vm.VM(bytearray(self.self_modifying)).run(), b"XYZ")
+
+    def test_jit(self):
+        for program in (self.hello_world, self.self_modifying, vm_samples.countdown_program(3)):
+            interpreted = vm.VM(bytearray(program))
+            compiled = vm.VM(bytearray(program), jit = True)
+
+            self.assertEqual(compiled.run(), interpreted.run())
+            self.assertEqual(compiled.registers, interpreted.registers)
+
+            # Forgotten blocks don't leave anything behind.
+            memory = compiled.memory
+            owned_length = sum(len(owners) for owners in memory.block_owners.values())
+
+            self.assertEqual(owned_length, sum(memory.block_ends[start] - start for start in memory.blocks))
+
+            for address, owners in memory.block_owners.items():
+                for start in owners:
+                    self.assertLessEqual(start, address)
+                    self.assertLess(address, memory.block_ends[start])
+
+    def test_profiler(self):
+        reports = []
+        profiler = vm_profiler.Profiler(trace_length = 5, callback = reports.append)
+        program = vm_samples.countdown_program(3)
+
+        self.assertEqual(vm.VM(bytearray(program), profiler = profiler).run(), vm.VM(bytearray(program)).run())
+        self.assertEqual(reports, [profiler])
+
+        # Loops include the instructions of the loops nested in them, so the
+        # outer loop comes first.
+        outer, inner = profiler.hot_loops(2)
+        self.assertEqual((outer["start"], outer["end"]), (2, 26))
+        self.assertEqual(outer["iterations"], 2)
+
+        # The inner loop runs its 7 instructions 255 times per outer iteration.
+        self.assertEqual((inner["start"], inner["end"]), (4, 12))
+        self.assertEqual(inner["instructions"], 3 * 255 * 7)
+        self.assertEqual(inner["iterations"], 3 * 254)
+
+        self.assertEqual(profiler.opcode_counts()["OUT"], 3)
+        self.assertEqual(profiler.opcode_counts()["HALT"], 1)
+        self.assertEqual(profiler.instruction_count, sum(profiler.pc_counts().values()))
+        self.assertEqual(profiler.trace_entries()[-1], (31, "HALT"))
+        self.assertEqual(len(profiler.trace_entries()), 5)
+
+        report = json.loads(profiler.to_json())
+        self.assertEqual(report["instructions"], profiler.instruction_count)
+        self.assertEqual(report["hot_loops"], [outer, inner])
+
+    def test_run_slice(self):
+        machine = vm.VM(bytearray(self.hello_world))
+        output = bytearray()
+        slices = 1
+
+        while not machine.run_slice(output, budget = 5):
+            slices += 1
+
+        self.assertEqual(output, b"Hello, world!")
+        self.assertGreater(slices, 1)
+
+        # Halted programs stay halted.
+        self.assertTrue(machine.run_slice(output, budget = 5))
+        self.assertTrue(machine.run_slice(output, time_slice = 0.0))
+        self.assertEqual(output, b"Hello, world!")
+
+    def test_run_async(self):
+        batches = []
+
+        async def collect(batch):
+            batches.append(batch)
+
+        async def run_all():
+            return await asyncio.gather(
+                vm.VM(bytearray(vm_samples.countdown_program(3))).run_async(collect, budget = 1000),
+                vm.VM(bytearray(self.hello_world)).run_async(budget = 10),
+                vm.VM(bytearray(self.self_modifying)).run_async(time_slice = 0.001),
+            )
+
+        results = asyncio.run(run_all())
+
+        self.assertEqual(results, [None, b"Hello, world!", b"XYZ"])
+        self.assertEqual(b"".join(batches), vm.VM(bytearray(vm_samples.countdown_program(3))).run())
+        self.assertGreater(len(batches), 1)
+
+    def test_copy_on_write(self):
+        image = bytes(self.self_modifying) + bytes(3 * vm_memory.page_length)
+        data = vm_memory.CopyOnWriteData(image)
+
+        machine = vm.VM(data)
+        expected = vm.VM(bytearray(image))
+
+        self.assertEqual(machine.run(), expected.run())
+        self.assertEqual(bytes(data), expected.memory.data)
+        self.assertEqual(data.dirty_length, vm_memory.page_length)
+
+        # VMs that don't take snapshots never go through the whole image.
+        self.assertIsNone(machine.memory.clean_digest)
+
+        # Compiled blocks read from it as well.
+        self.assertEqual(vm.VM(vm_memory.CopyOnWriteData(image), jit = True).run(), b"XYZ")
+
+    def test_bounds(self):
+        # MVI a <- 1, followed by the program's end.
+        for data in (bytearray(b"\x48\x01"), vm_memory.CopyOnWriteData(b"\x48\x01")):
+            with self.assertRaisesRegex(IndexError, "out of bounds"):
+                vm.VM(data).run()
+
+            with self.assertRaisesRegex(IndexError, "out of bounds"):
+                vm.VM(data).memory.write_at(2, 1, 0)
+
+    def test_run_batch(self):
+        image = vm_samples.countdown_program(3)
+
+        # Patch the number of outer iterations.
+        patches = [[(1, bytes([i]))] for i in range(1, 6)]
+        expected = [vm.VM(bytearray(image[0 : 1] + bytes([i]) + image[2 : ])).run() for i in range(1, 6)]
+
+        self.assertEqual(vm.run_batch(image, patches, workers = 2), expected)
+        self.assertEqual(vm.run_batch(image, patches, workers = 1), expected)
+
+    def test_disassembler(self):
+        instructions = vm_disassembler.disassemble(self.self_modifying)
+
+        self.assertEqual([instruction.text for instruction in instructions[0 : 6]], [
+            "MVI32 ptr <- 0x0000000F", "MVI c <- 0x00", "MVI d <- 0x03",
+            "MVI32 pc <- 0x0000000E", "MVI a <- 0x58", "OUT",
+        ])
+        self.assertEqual(instructions[7].text, "MVI b <- 0x01")
+        self.assertEqual(instructions[9].text, "MV (ptr+c) <- a")
+        self.assertEqual(instructions[-1].text, "HALT")
+
+        self.assertEqual([instruction.text for instruction in vm_disassembler.disassemble(bytes([0xE1, 0x10, 0x01]))],
+                         ["APTR 0x10", "HALT"])
+
+        # Invalid opcodes don't stop it.
+        self.assertEqual([instruction.text for instruction in vm_disassembler.disassemble(b"\x00\x01")], ["DB", "HALT"])
+
+    def test_cfg(self):
+        blocks = vm_disassembler.build_cfg(vm.VM(bytearray(vm_samples.countdown_program())))
+
+        self.assertEqual(sorted(blocks.keys()), [0, 2, 4, 17, 31])
+        self.assertEqual(blocks[4].successors, [4, 17])
+        self.assertEqual(blocks[17].successors, [2, 31])
+        self.assertEqual(blocks[31].successors, [])
+
+    def test_peephole(self):
+        programs = (self.hello_world, self.self_modifying, vm_samples.countdown_program(3),
+                    vm_samples.message_program(b"Hello, world!"))
+
+        for program in programs:
+            for jit in (False, True):
+                original = vm.VM(bytearray(program))
+                optimized = vm.VM(bytearray(program), jit = jit)
+
+                self.assertGreater(vm_peephole.optimize(optimized), 0)
+
+                self.assertEqual(optimized.run(), original.run())
+                self.assertEqual(optimized.registers, original.registers)
+                self.assertEqual(optimized.memory.data, original.memory.data)
+
+        # Chains of MVI, MVI, XOR and OUT run in a single dispatch.
+        profiler = vm_profiler.Profiler()
+        machine = vm.VM(bytearray(vm_samples.message_program(b"Hello")), profiler = profiler)
+        vm_peephole.optimize(machine)
+        machine.run()
+
+        self.assertEqual(profiler.opcode_counts(), {"MVI+MVI+XOR+OUT": 5, "HALT": 1})
+
+    def test_snapshot(self):
+        for program in (self.hello_world, self.self_modifying):
+            expected = vm.VM(bytearray(program)).run()
+
+            for budget in range(1, 40):
+                machine = vm.VM(bytearray(program))
+                output = bytearray()
+                machine.run_slice(output, budget)
+
+                snapshot = machine.snapshot(len(output))
+
+                restored = vm.VM(bytearray(program))
+                output_offset = restored.restore(snapshot)
+
+                self.assertEqual(restored.registers, machine.registers)
+                self.assertEqual(output[ : output_offset] + restored.run(), expected)
+
+        # Only written pages are stored.
+        image = bytes(self.self_modifying) + bytes(16 * vm_memory.page_length)
+        machine = vm.VM(vm_memory.CopyOnWriteData(image))
+        machine.run()
+
+        self.assertLess(len(machine.snapshot()), vm_memory.page_length + 64)
+
+        with self.assertRaises(ValueError):
+            machine.restore(machine.snapshot())
+
+        with self.assertRaises(ValueError):
+            vm.VM(bytearray(self.hello_world)).restore(machine.snapshot())
+
+        # Same length, but a different image.
+        different_image = bytes(self.self_modifying) + bytes([1]) * (16 * vm_memory.page_length)
+
+        with self.assertRaisesRegex(ValueError, "different memory image"):
+            vm.VM(bytearray(different_image)).restore(machine.snapshot())
+
+        vm.VM(bytearray(image)).restore(machine.snapshot())
+
+        # Pages patched before running count as written (see "run_patched").
+        data = vm_memory.CopyOnWriteData(image)
+        data[3 * vm_memory.page_length] = 7
+
+        machine = vm.VM(data)
+        self.assertEqual(machine.memory.dirty_pages, {3})
+
+        restored = vm.VM(bytearray(image))
+        restored.restore(machine.snapshot())
+
+        self.assertEqual(restored.memory.data[3 * vm_memory.page_length], 7)
+
+    def test_run_checkpointed(self):
+        program = vm_samples.countdown_program(3)
+        expected = vm.VM(bytearray(program)).run()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint")
+
+            self.assertEqual(vm.VM(bytearray(program)).run_checkpointed(path, 1000), expected)
+
+            # Resume from the last checkpoint, as if the process had stopped
+            # right after writing it.
+            with open(path, "rb") as checkpoint:
+                machine = vm.VM(bytearray(program))
+                output_offset = machine.restore(checkpoint.read())
+
+            self.assertGreater(machine.registers[vm.PC], 0)
+            self.assertEqual(expected[ : output_offset] + machine.run(), expected)
+
+    def test_register_view(self):
+        machine = vm.VM(bytearray(self.self_modifying))
+        machine.run()
+
+        registers = machine.register_view
+
+        self.assertEqual(registers["ptr"], 15)
+        self.assertEqual(registers["d"], 0)
+        self.assertEqual(registers["pc"], 35)
+        self.assertEqual(len(dict(registers)), 12)
+
+        with self.assertRaises(TypeError):
+            registers["a"] = 1
@@ -0,0 +1,72 @@
+import unittest
+import xoring
+
+class TestXoring(unittest.TestCase):
+
+    def setUp(self):
+        self.byte_data = bytes(range(256)) * 3 + b"onion"
+        self.key = b"Tom's data onion"
+
+    def expected_xor(self, offset):
+        return bytes(b ^ self.key[(i + offset) % len(self.key)] for i, b in enumerate(self.byte_data))
+
+    def test_xor(self):
+        for offset in (0, 5, len(self.key) + 3):
+            actual = xoring.xor(self.byte_data, self.key, offset)
+
+            self.assertEqual(actual, self.expected_xor(offset))
+
+    def test_xor_pure_python(self):
+        # Force the pure-Python path, with blocks smaller than the data.
+        numpy, xoring.numpy = xoring.numpy, None
+        block_length, xoring.block_length = xoring.block_length, 100
+
+        try:
+            self.assertEqual(xoring.xor(self.byte_data, self.key, 7), self.expected_xor(7))
+        finally:
+            xoring.numpy = numpy
+            xoring.block_length = block_length
+
+    def test_recover_key(self):
+        plain_text = b"==[ Layer 4/6: Network Traffic ]============================\n"
+        plain_text += b"Packets contain extra data like the destination address, where the packet should be sent to. " * 40
+
+        cipher_text = xoring.xor(plain_text, xoring.key)
+
+        self.assertEqual(xoring.guess_key_length(cipher_text, 64), len(xoring.key))
+
+        key, confidences = xoring.recover_key(cipher_text, [b"==[ Layer 4/6: ", b"=" * 13], len(xoring.key))
+
+        self.assertEqual(key, xoring.key)
+        self.assertEqual(confidences, [1.0] * len(xoring.key))
+
+    def test_recover_key_short(self):
+        # Too short for the columns' statistics (31 of 32 key bytes come out
+        # wrong without cribs), so only the cribs can recover the key.
+        plain_text = b"==[ Layer 4/6: Network Traffic ]============================\n"
+        plain_text += b"Packets contain extra data like the destination address.\n"
+
+        cipher_text = xoring.xor(plain_text, xoring.key)
+        cribs = [b"==[ Layer 4/6: Network Traffic ]", b"=" * 28]
+
+        key, _ = xoring.recover_key(cipher_text, (), len(xoring.key))
+        self.assertNotEqual(key, xoring.key)
+
+        key, _ = xoring.recover_key(cipher_text, cribs, len(xoring.key))
+        self.assertEqual(key, xoring.key)
+
+        # A longer crib that isn't in the text adds up to a higher score, but
+        # not per byte, so it doesn't win over the ones that are.
+        cribs.append(b"Not in the text at all, not even a bit of it")
+
+        numpy = xoring.numpy
+
+        try:
+            # With NumPy (if installed), and forcing the pure-Python path.
+            for module in (numpy, None):
+                xoring.numpy = module
+
+                key, _ = xoring.recover_key(cipher_text, cribs, len(xoring.key))
+                self.assertEqual(key, xoring.key)
+        finally:
+            xoring.numpy = numpy
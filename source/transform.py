@@ -0,0 +1,64 @@
+import math
+
+# A byte transform maps every byte into another one, possibly depending on
+# its position. It's stored as one 256-entry table per position in the
+# period, so that byte "i" goes through table "i % period" (e.g. a 32-byte
+# XOR key is made of 32 tables, while a per-byte map is made of only one).
+#
+# Adjacent transforms can be fused ahead of time into a single one, which
+# then runs in one pass over the data, with one output allocation.
+class ByteTransform:
+    def __init__(self, tables):
+        self.tables = [bytes(table) for table in tables]
+
+    @classmethod
+    def from_table(cls, table: bytes):
+        return cls([table])
+
+    @classmethod
+    def from_function(cls, function):
+        return cls([bytes(function(character) for character in range(256))])
+
+    # XOR against a repeating key, starting at the key's first byte.
+    @classmethod
+    def from_xor_key(cls, key: bytes):
+        return cls([bytes(character ^ k for character in range(256)) for k in key])
+
+    @property
+    def period(self):
+        return len(self.tables)
+
+    # Returns a transform equivalent to applying this one, and then "other".
+    def then(self, other: "ByteTransform"):
+        period = math.lcm(self.period, other.period)
+
+        # NOTE: Translating a table through another one composes them.
+        tables = [self.tables[i % self.period].translate(other.tables[i % other.period])
+                  for i in range(period)]
+
+        return ByteTransform(tables)
+
+    # Transforms the data. "offset" is the position of the first byte within
+    # the period, which allows transforming a stream one chunk at a time.
+    def apply(self, byte_data: bytes, offset: int = 0):
+        if self.period == 1:
+            return bytearray(byte_data.translate(self.tables[0]))
+
+        byte_result = bytearray(len(byte_data))
+
+        # Every "period"-th byte goes through the same table, so each of these
+        # strided slices can be translated at once.
+        for i in range(min(self.period, len(byte_data))):
+            table = self.tables[(offset + i) % self.period]
+            byte_result[i : : self.period] = byte_data[i : : self.period].translate(table)
+
+        return byte_result
+
+# Fuses several transforms, applied from first to last, into a single one.
+def fuse(*transforms: ByteTransform):
+    result = transforms[0]
+
+    for transform in transforms[1 : ]:
+        result = result.then(transform)
+
+    return result
@@ -1,80 +1,400 @@
+import asyncio
+import concurrent.futures
+import inspect
+import itertools
+import multiprocessing.shared_memory
+import os
+import struct
+import time
+import vm_jit
+
 from vm_handlers import *
 from vm_memory import *
+from vm_registers import *
+
+# Default number of instructions run between yields to the event loop (see
+# "VM.stream").
+slice_budget = 64 * 1024
+
+# Number of instructions run between clock checks, when running for a time
+# slice (see "VM.run_slice").
+clock_interval = 1024
+
+# Snapshot format (see "VM.snapshot"): a header (with the CRC-32 of the
+# memory pages it doesn't store, see "VMMemory.get_clean_digest"), followed
+# by the registers, the number of pages stored and then every page, preceded
+# by its number. Pages are "page_length" bytes long, except for the last page
+# of memory.
+snapshot_magic = b"TVMS"
+snapshot_version = 3
+snapshot_header_layout = struct.Struct("<4sBQIII")
+snapshot_registers_layout = struct.Struct("<6B6I")
+snapshot_page_count_layout = struct.Struct("<I")
+snapshot_page_number_layout = struct.Struct("<I")
+
+# Default number of instructions between checkpoints (see
+# "VM.run_checkpointed").
+checkpoint_interval = 1024 * 1024
 
 class VM:
-    def __init__(self, memory_data: bytes):
-        self.registers = {
-            # 8-bit registers.
-            "a": 0, "b": 0, "c": 0, "d": 0, "e": 0, "f": 0,
+    # If "jit" is set, basic blocks are compiled into Python functions (see
+    # "vm_jit") instead of being interpreted one instruction at a time.
+    #
+    # If "profiler" is given (see "vm_profiler"), "run" collects execution
+    # statistics into it.
+    def __init__(self, memory_data: bytes, jit: bool = False, profiler = None):
+        self.jit = jit
+        self.profiler = profiler
 
-            # 32-bit registers.
-            "la": 0, "lb": 0, "lc": 0, "ld": 0, "ptr": 0, "pc": 0,
-        }
+        # 8-bit ("a" to "f") and 32-bit ("la" to "ld", "ptr" and "pc")
+        # registers, indexed by the constants in "vm_registers".
+        self.registers = new_register_file()
 
         self.memory = VMMemory(self.registers, memory_data)
 
-        # Maps an opcode to the corresponding handler class, which
-        # will load the instruction and execute it. Instructions
-        # that are less-than-a-byte long, such as MV or MV32, are
-        # not included here since they require a little more special
-        # handling.
-        self.opcode_to_handler = {
-            0xC2: ADDHandler, 0xE1: APTRHandler, 0xC1: CMPHandler,
-            0x21: JEZHandler, 0x22: JNZHandler, 0x02: OUTHandler,
-            0xC3: SUBHandler, 0xC4: XORHandler,
-        }
+    # Read-only mapping of register names into their values, for debugging.
+    @property
+    def register_view(self):
+        return RegisterView(self.registers)
 
     def run(self):
         output = bytearray()
 
-        while self.next(output):
-            pass
+        # NOTE: Profiling and compiled blocks have their own loops, so the
+        # usual one doesn't check for them on every instruction.
+        if self.profiler is not None:
+            self.profiler.run(self, output)
+            return output
+
+        if self.jit:
+            self.run_compiled(output)
+            return output
+
+        # NOTE: This is the same as calling "next" until it returns False,
+        # but avoiding a method call and several attribute lookups for every
+        # instruction.
+        registers = self.registers
+        memory = self.memory
+        decoded = memory.decoded
+
+        while True:
+            pc = registers[PC]
+            instruction = decoded.get(pc)
+
+            if instruction is None:
+                instruction = self.decode(pc)
+
+            handler, length = instruction
+
+            if handler.halts:
+                break
+
+            registers[PC] = pc + length
+            handler.execute(registers, memory, output)
+
+        return output
+
+    # Runs compiled basic blocks until the program halts.
+    def run_compiled(self, output: bytearray):
+        registers = self.registers
+        memory = self.memory
+        blocks = memory.blocks
+
+        pc = registers[PC]
+
+        while pc is not None:
+            block = blocks.get(pc)
+
+            if block is None:
+                block = vm_jit.compile_block(self, pc)
+
+            pc = block(registers, memory, output)
+
+    # Runs at most "budget" instructions, or for at most "time_slice"
+    # seconds (roughly), appending the output into "output". Returns whether
+    # the program halted. If it didn't, calling it again resumes it.
+    #
+    # NOTE: Compiled blocks can loop without returning, so slices are always
+    # interpreted.
+    def run_slice(self, output: bytearray, budget: int = None, time_slice: float = None):
+        deadline = time.perf_counter() + time_slice if time_slice is not None else None
+
+        while True:
+            count = clock_interval if budget is None else min(budget, clock_interval)
+
+            if self.run_instructions(output, count):
+                return True
+
+            if budget is not None:
+                budget -= count
+
+                if budget == 0:
+                    return False
+
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+
+    # Runs at most "count" instructions. Returns whether the program halted.
+    def run_instructions(self, output: bytearray, count: int):
+        registers = self.registers
+        memory = self.memory
+        decoded = memory.decoded
+
+        for _ in itertools.repeat(None, count):
+            pc = registers[PC]
+            instruction = decoded.get(pc)
+
+            if instruction is None:
+                instruction = self.decode(pc)
+
+            handler, length = instruction
+
+            if handler.halts:
+                return True
+
+            registers[PC] = pc + length
+            handler.execute(registers, memory, output)
+
+        return False
+
+    # Runs the program in slices (see "run_slice"), yielding to the event
+    # loop between them, and yields the output of every slice that has any.
+    async def stream(self, budget: int = slice_budget, time_slice: float = None):
+        halted = False
+
+        while not halted:
+            output = bytearray()
+            halted = self.run_slice(output, budget, time_slice)
+
+            if len(output) != 0:
+                yield bytes(output)
+
+            await asyncio.sleep(0)
+
+    # Runs the program in slices (see "stream"), passing the output of every
+    # slice to "sink", which can be either a function or a coroutine function.
+    # If no sink is given, returns the whole output instead.
+    async def run_async(self, sink = None, budget: int = slice_budget, time_slice: float = None):
+        output = bytearray()
+
+        async for batch in self.stream(budget, time_slice):
+            if sink is None:
+                output += batch
+                continue
+
+            result = sink(batch)
+
+            if inspect.isawaitable(result):
+                await result
+
+        return output if sink is None else None
+
+    # Returns the state of the VM in a compact binary format: its registers,
+    # the memory pages written since it was created and "output_offset",
+    # which is meant to be the length of the output so far. Its cost mostly
+    # depends on the amount of memory written (besides the CRC-32 of the
+    # rest, computed again only after writing other pages).
+    def snapshot(self, output_offset: int = 0):
+        memory = self.memory
+        dirty_pages = sorted(memory.dirty_pages)
+
+        byte_result = bytearray(snapshot_header_layout.pack(snapshot_magic, snapshot_version, output_offset,
+                                                            memory.length, page_length, memory.get_clean_digest()))
+        byte_result += snapshot_registers_layout.pack(*self.registers[A : PC + 1])
+        byte_result += snapshot_page_count_layout.pack(len(dirty_pages))
+
+        for page_number in dirty_pages:
+            page_start = page_number * page_length
+
+            byte_result += snapshot_page_number_layout.pack(page_number)
+            byte_result += memory.data[page_start : page_start + page_length]
+
+        return bytes(byte_result)
+
+    # Restores the state saved by "snapshot" into a VM created from the same
+    # memory image, which must not have run yet. Returns the snapshot's
+    # output offset.
+    def restore(self, snapshot: bytes):
+        memory = self.memory
+
+        if len(memory.dirty_pages) != 0:
+            raise ValueError("Snapshots can only be restored into unmodified memory")
+
+        magic, version, output_offset, memory_length, snapshot_page_length, image_digest = \
+            snapshot_header_layout.unpack_from(snapshot, 0)
+
+        if magic != snapshot_magic or version != snapshot_version:
+            raise ValueError("Not a VM snapshot, or an unsupported version of one")
+
+        if memory_length != memory.length or snapshot_page_length != page_length:
+            raise ValueError("Snapshot of a %d bytes long memory, but memory is %d bytes long"
+                             % (memory_length, memory.length))
+
+        offset = snapshot_header_layout.size
+        registers = snapshot_registers_layout.unpack_from(snapshot, offset)
+        offset += snapshot_registers_layout.size
+
+        page_count, = snapshot_page_count_layout.unpack_from(snapshot, offset)
+        offset += snapshot_page_count_layout.size
+
+        # Find every page first, as the ones not stored must match the image
+        # the snapshot was taken from.
+        pages = []
+
+        for _ in range(page_count):
+            page_number, = snapshot_page_number_layout.unpack_from(snapshot, offset)
+            offset += snapshot_page_number_layout.size
+
+            page_start = page_number * page_length
+            page_end = min(page_start + page_length, memory_length)
+
+            memory.check_bounds(page_start, page_end - page_start)
+            pages.append((page_number, page_start, page_end, offset))
+
+            offset += page_end - page_start
+
+        if image_digest != memory.get_clean_digest({page_number for page_number, _, _, _ in pages}):
+            raise ValueError("Snapshot of a different memory image")
+
+        for page_number, page_start, page_end, offset in pages:
+            memory.data[page_start : page_end] = snapshot[offset : offset + page_end - page_start]
+            memory.invalidate(page_start, page_end - page_start)
+            memory.dirty_pages.add(page_number)
+
+        self.registers[A : PC + 1] = registers
+
+        return output_offset
+
+    # Runs the program like "run", but writes a snapshot into "path" every
+    # "interval" instructions (replacing the previous one), so that it can
+    # be resumed with "restore" if the process stops. The output offset of
+    # each snapshot counts from the start of "output".
+    def run_checkpointed(self, path: str, interval: int = checkpoint_interval, output: bytearray = None):
+        if output is None:
+            output = bytearray()
+
+        while not self.run_slice(output, interval):
+            snapshot = self.snapshot(len(output))
+
+            # NOTE: Replacing the file at once means a crash while writing it
+            # leaves the previous checkpoint intact.
+            with open(path + ".tmp", "wb") as checkpoint:
+                checkpoint.write(snapshot)
+
+            os.replace(path + ".tmp", path)
 
         return output
 
     def next(self, output: bytearray):
-        # Get the instruction code, which is one byte long or less.
-        opcode = self.memory.peek(1)
-        opcode = int.from_bytes(opcode, "little")
+        pc = self.registers[PC]
 
-        # Object associated with the instruction which can load and
-        # execute it.
-        handler = None
+        # Instructions are decoded only the first time they're found, unless
+        # the memory they're in is modified.
+        instruction = self.memory.decoded.get(pc)
 
-        # HALT instruction. It is kinda murky to analyze the opcode
-        # here since I'm effectively ignoring the HALTHandler class,
-        # but oh well.
-        if opcode == 0x01:
+        if instruction is None:
+            instruction = self.decode(pc)
+
+        handler, length = instruction
+
+        if handler.halts:
             return False
 
-        if opcode in self.opcode_to_handler.keys():
-            handler = self.opcode_to_handler[opcode]()
-        else:
-            # Transform the opcode into its binary representation and
-            # remove the leading "0b" part.
-            binary_opcode = bin(opcode)[2 : ]
-
-            # Make the binary representation 8 bits long (each bit
-            # represented by a character).
-            while len(binary_opcode) < 8:
-                binary_opcode = "0" + binary_opcode
-
-            # Get the first two bits which indicate if the operation
-            # is either a MV or MV32 instruction. MVI and MVI32
-            # instructions are just derivatives of them.
-            binary_opcode = binary_opcode[0 : 2]
-
-            if binary_opcode == "01":
-                handler = MVHandler()
-            elif binary_opcode == "10":
-                handler = MV32Handler()
-            else:
-                # TODO: Throw error.
-                pass
-
-        # Load the instruction from memory and execute it.
-        handler.load(self.memory)
+        # The program counter points to the next instruction by the time the
+        # current one is executed, as if it had just been read.
+        self.registers[PC] = pc + length
         handler.execute(self.registers, self.memory, output)
 
         # Keep processing instructions.
         return True
+
+    # Loads the instruction at "address" into its handler, and stores it in
+    # the memory's cache of decoded instructions. Returns a (handler, length)
+    # tuple.
+    def decode(self, address: int):
+        # Get the instruction code, which is one byte long or less.
+        opcode = self.memory.peek_from(address, 1)
+        opcode = int.from_bytes(opcode, "little")
+
+        handler_class = dispatch_table[opcode]
+
+        if handler_class is None:
+            raise ValueError("Unknown opcode 0x%02X at address 0x%08X" % (opcode, address))
+
+        # Handlers load instructions from the program counter, so point it to
+        # the instruction for a moment.
+        pc = self.registers[PC]
+        self.registers[PC] = address
+
+        try:
+            handler = handler_class()
+            handler.load(self.memory)
+
+            length = self.registers[PC] - address
+        finally:
+            self.registers[PC] = pc
+
+        return self.memory.cache_instruction(address, handler, length)
+
+# Runs the VM over "image" once for every patch in "patches", each of which
+# is a sequence of (offset, bytes) writes applied to the VM's memory before
+# running it. Returns the output of every run, in the same order.
+def run_patched(image, patches, jit: bool = False):
+    outputs = []
+
+    for patch in patches:
+        data = CopyOnWriteData(image)
+
+        for offset, byte_data in patch:
+            data[offset : offset + len(byte_data)] = byte_data
+
+        outputs.append(bytes(VM(data, jit).run()))
+
+    return outputs
+
+# Runs a batch of "run_batch" over a shared memory block. Runs on a worker
+# process.
+def _run_shared_image(shared_memory_name: str, image_length: int, patches, jit: bool):
+    shared_memory = multiprocessing.shared_memory.SharedMemory(name = shared_memory_name)
+    image = shared_memory.buf[0 : image_length]
+
+    try:
+        return run_patched(image, patches, jit)
+    finally:
+        image.release()
+        shared_memory.close()
+
+# Same as "run_patched", but the runs are split into batches for a pool of
+# processes. The image is placed in shared memory once, and every VM reads
+# from it through a "CopyOnWriteData", so only the patches are sent to the
+# workers, and each VM only copies the pages it writes.
+def run_batch(image, patches, workers: int = None, jit: bool = False):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    patches = list(patches)
+
+    if workers <= 1 or len(patches) <= 1:
+        return run_patched(image, patches, jit)
+
+    shared_memory = multiprocessing.shared_memory.SharedMemory(create = True, size = max(len(image), 1))
+
+    try:
+        shared_memory.buf[0 : len(image)] = image
+
+        # Use a few batches per worker so that a slow one doesn't hold the rest.
+        batch_length = -(-len(patches) // (workers * 4))
+        batches = [patches[i : i + batch_length] for i in range(0, len(patches), batch_length)]
+        outputs = []
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+            # NOTE: "map" returns the results in the same order as the batches,
+            # regardless of which one finishes first.
+            for batch_outputs in executor.map(_run_shared_image, [shared_memory.name] * len(batches),
+                                              [len(image)] * len(batches), batches, [jit] * len(batches)):
+                outputs += batch_outputs
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+    return outputs
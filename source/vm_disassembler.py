@@ -0,0 +1,207 @@
+import sys
+import vm
+
+from vm_handlers import *
+from vm_memory import *
+from vm_registers import *
+
+# Returns the assembly text of a decoded instruction (e.g. "MVI a <- 0x48").
+def format_handler(handler):
+    mnemonic = handler.mnemonic
+
+    if isinstance(handler, MVHandler):
+        destination = "(ptr+c)" if handler.destination == PTR_C else register_names[handler.destination]
+
+        if handler.source == 0:
+            source = "0x%02X" % handler.immediate
+        else:
+            source = "(ptr+c)" if handler.source == PTR_C else register_names[handler.source]
+
+        return "%s %s <- %s" % (mnemonic, destination, source)
+
+    if isinstance(handler, MV32Handler):
+        source = "0x%08X" % handler.immediate if handler.source == 0 else register_names[handler.source]
+
+        return "%s %s <- %s" % (mnemonic, register_names[handler.destination], source)
+
+    if isinstance(handler, (JEZHandler, JNZHandler)):
+        return "%s 0x%08X" % (mnemonic, handler.immediate)
+
+    if isinstance(handler, APTRHandler):
+        return "%s 0x%02X" % (mnemonic, handler.immediate)
+
+    return mnemonic
+
+# An instruction found by the disassembler. "handler" is "None" for bytes
+# that are not a valid instruction.
+class Instruction:
+    __slots__ = ("address", "length", "handler")
+
+    def __init__(self, address: int, length: int, handler):
+        self.address = address
+        self.length = length
+        self.handler = handler
+
+    @property
+    def text(self):
+        return format_handler(self.handler) if self.handler is not None else "DB"
+
+    def __repr__(self):
+        return "<Instruction 0x%08X %s>" % (self.address, self.text)
+
+# Returns a VM that decodes instructions from "data" without modifying it.
+def _decoder(data):
+    return vm.VM(CopyOnWriteData(data))
+
+# Decodes the instruction at "address" with the VM's own decoder (and opcode
+# table), so instructions are exactly as the VM will run them.
+def decode_at(machine, address: int):
+    try:
+        handler, length = machine.memory.decoded.get(address) or machine.decode(address)
+    except (ValueError, IndexError):
+        return Instruction(address, 1, None)
+
+    return Instruction(address, length, handler)
+
+# Decodes every instruction from "start" to "end" (or the end of "data"),
+# one after the other. Bytes that are not valid instructions are returned
+# as one byte long instructions with no handler.
+def disassemble(data, start: int = 0, end: int = None):
+    machine = _decoder(data)
+
+    if end is None:
+        end = len(data)
+
+    instructions = []
+    address = start
+
+    while address < end:
+        instruction = decode_at(machine, address)
+        instructions.append(instruction)
+        address += instruction.length
+
+    return instructions
+
+# Whether an instruction changes the control flow. Unlike
+# "Handler.ends_block", memory writes don't count.
+def _ends_flow(handler):
+    return handler is None or handler.halts or isinstance(handler, (JEZHandler, JNZHandler)) \
+        or (isinstance(handler, MV32Handler) and handler.destination == PC)
+
+# Addresses execution may continue at after "instruction". "None" stands
+# for an address that's only known at run time (MV32 into "pc" from a
+# register).
+def _successors(instruction):
+    handler = instruction.handler
+    next_address = instruction.address + instruction.length
+
+    if handler is None or handler.halts:
+        return []
+
+    if isinstance(handler, (JEZHandler, JNZHandler)):
+        return [handler.immediate, next_address]
+
+    if isinstance(handler, MV32Handler) and handler.destination == PC:
+        return [handler.immediate if handler.source == 0 else None]
+
+    return [next_address]
+
+class BasicBlock:
+    __slots__ = ("start", "instructions", "successors")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.instructions = []
+        self.successors = []
+
+    @property
+    def end(self):
+        last = self.instructions[-1]
+        return last.address + last.length
+
+    def __repr__(self):
+        return "<BasicBlock 0x%08X-0x%08X>" % (self.start, self.end)
+
+# Builds the control flow graph of the code reachable from "entry" (by
+# default, the VM's program counter). Returns the basic blocks by their
+# start address.
+#
+# NOTE: Code written by the program itself, and jumps to addresses held in
+# registers, can't be followed statically. Blocks that end with the latter
+# have "None" among their successors.
+def build_cfg(machine, entry: int = None):
+    if entry is None:
+        entry = machine.registers[PC]
+
+    # Find every reachable instruction, and the addresses control flow can
+    # reach other than by falling through (block leaders).
+    instructions = {}
+    leaders = {entry}
+    pending = [entry]
+
+    while len(pending) != 0:
+        address = pending.pop()
+
+        while address not in instructions and 0 <= address < machine.memory.length:
+            instruction = decode_at(machine, address)
+            instructions[address] = instruction
+
+            if _ends_flow(instruction.handler):
+                for successor in _successors(instruction):
+                    if successor is not None:
+                        leaders.add(successor)
+                        pending.append(successor)
+
+                break
+
+            address += instruction.length
+
+    # Split the instructions into blocks at leaders and control flow changes.
+    blocks = {}
+
+    for start in sorted(leaders):
+        if start not in instructions:
+            continue
+
+        block = BasicBlock(start)
+        address = start
+
+        while True:
+            instruction = instructions[address]
+            block.instructions.append(instruction)
+            address += instruction.length
+
+            if _ends_flow(instruction.handler):
+                block.successors = _successors(instruction)
+                break
+
+            if address in leaders or address not in instructions:
+                block.successors = [address]
+                break
+
+        blocks[start] = block
+
+    return blocks
+
+# Returns the listing of the code reachable from the start of "data", one
+# basic block at a time.
+def format_cfg(data):
+    lines = []
+
+    for block in build_cfg(_decoder(data), 0).values():
+        successors = ", ".join("0x%08X" % successor if successor is not None else "?"
+                               for successor in block.successors)
+
+        lines.append("block_%08X: ; -> %s" % (block.start, successors or "halt"))
+
+        for instruction in block.instructions:
+            byte_data = bytes(data[instruction.address : instruction.address + instruction.length])
+            lines.append("    %08X  %-15s %s" % (instruction.address, byte_data.hex(" "), instruction.text))
+
+    return "\n".join(lines)
+
+# Usage: python vm_disassembler.py program
+# Prints the basic blocks of a VM program (raw bytecode).
+if __name__ == "__main__":
+    with open(sys.argv[1], "rb") as program:
+        print(format_cfg(program.read()))
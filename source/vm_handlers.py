@@ -1,3 +1,5 @@
+from vm_registers import *
+
 # NOTE: I took some inspiration from Rev Downie @ GitHub to code the
 # classes "MVHandler" and "MV32Handler", more specifically, how they handle
 # immediate vs non-immediate instructions (MV vs MVI and MV32 vs MVI32).
@@ -7,16 +9,39 @@
 # so I was getting a little bit frustrated. In the end, the problem was
 # somewhere else (at the ASCII85 decoding process).
 
-class ADDHandler:
+# Common behaviour of every handler. Handlers are created and loaded once
+# per instruction address (see "VM.decode"), and then executed as many times
+# as needed, so as much work as possible is done while loading.
+#
+# Handlers can also translate their instruction into Python source code (see
+# "vm_jit"), which works on local variables named after the registers, and
+# sets "pc" if the instruction must end a basic block.
+class Handler:
+    # Whether the VM must stop, instead of executing the instruction.
+    halts = False
+
+    # Whether the instruction (may) change the program counter or write
+    # into memory, either of which ends a basic block.
+    ends_block = False
+
+    # Name of the instruction, as in the specification (e.g. "ADD").
+    @property
+    def mnemonic(self):
+        return type(self).__name__[ : -len("Handler")]
+
+class ADDHandler(Handler):
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
 
     def execute(self, registers, memory, output):
-        registers["a"] += registers["b"]
-        registers["a"] %= 255
+        # NOTE: The specification says the sum is modulo 255 (not 256).
+        registers[A] = (registers[A] + registers[B]) % 255
+
+    def translate(self, address, next_address):
+        return ["a = (a + b) % 255"]
 
-class APTRHandler:
+class APTRHandler(Handler):
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
@@ -24,20 +49,29 @@ class APTRHandler:
         self.immediate = int.from_bytes(self.immediate, "little")
 
     def execute(self, registers, memory, output):
-        registers["ptr"] += self.immediate
+        registers[PTR] = (registers[PTR] + self.immediate) & register_masks[PTR]
 
-class CMPHandler:
+    def translate(self, address, next_address):
+        return ["ptr = (ptr + %d) & %d" % (self.immediate, register_masks[PTR])]
+
+class CMPHandler(Handler):
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
 
     def execute(self, registers, memory, output):
-        if registers["a"] == registers["b"]:
-            registers["f"] = 0x00
+        if registers[A] == registers[B]:
+            registers[F] = 0x00
         else:
-            registers["f"] = 0x01
+            registers[F] = 0x01
+
+    def translate(self, address, next_address):
+        return ["f = 0x00 if a == b else 0x01"]
+
+class HALTHandler(Handler):
+    halts = True
+    ends_block = True
 
-class HALTHandler:
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
@@ -45,7 +79,13 @@ class HALTHandler:
     def execute(self, registers, memory, output):
         pass
 
-class JEZHandler:
+    # NOTE: The program counter is left pointing to the HALT instruction.
+    def translate(self, address, next_address):
+        return ["pc = %d" % address]
+
+class JEZHandler(Handler):
+    ends_block = True
+
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
@@ -53,10 +93,15 @@ class JEZHandler:
         self.immediate = int.from_bytes(self.immediate, "little")
 
     def execute(self, registers, memory, output):
-        if registers["f"] == 0x00:
-            registers["pc"] = self.immediate
+        if registers[F] == 0x00:
+            registers[PC] = self.immediate
+
+    def translate(self, address, next_address):
+        return ["pc = %d if f == 0x00 else %d" % (self.immediate, next_address)]
+
+class JNZHandler(Handler):
+    ends_block = True
 
-class JNZHandler:
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
@@ -64,103 +109,169 @@ class JNZHandler:
         self.immediate = int.from_bytes(self.immediate, "little")
 
     def execute(self, registers, memory, output):
-        if registers["f"] != 0x00:
-            registers["pc"] = self.immediate
+        if registers[F] != 0x00:
+            registers[PC] = self.immediate
+
+    def translate(self, address, next_address):
+        return ["pc = %d if f != 0x00 else %d" % (self.immediate, next_address)]
 
-class MVHandler:
+# Register number used by MV instructions for "ptr+c", a pseudo register
+# that indicates a memory location.
+PTR_C = 7
+
+class MVHandler(Handler):
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
 
+        # Register numbers are the same as the register file's indices (see
+        # "vm_registers").
+        self.destination = (self.opcode & 0b00111000) >> 3
+        self.source = (self.opcode & 0b00000111)
+
+        if self.destination == 0:
+            raise ValueError("Invalid MV destination in opcode 0x%02X" % self.opcode)
+
+        # Writing into memory may modify the code that follows.
+        self.ends_block = (self.destination == PTR_C)
+
         # A zero "source" indicates a MVI instruction instead of
         # a MV one, so, we need to read the immediate payload.
-        source = (self.opcode & 0b00000111)
-
-        if source == 0:
+        if self.source == 0:
             self.immediate = memory.read(1)
             self.immediate = int.from_bytes(self.immediate, "little")
 
-    def execute(self, registers, memory, output):
-        number_to_register = { 1: "a", 2: "b", 3: "c", 4: "d",
-                               5: "e", 6: "f", 7: "ptr+c" }
-
-        destination = (self.opcode & 0b00111000) >> 3
+    @property
+    def mnemonic(self):
+        return "MVI" if self.source == 0 else "MV"
 
-        source = (self.opcode & 0b00000111)
-        source_value = None
-
-        if source != 0:
-            if source != 7:
-                source_value = registers[number_to_register[source]]
-            else:
-                # "ptr+c" is a pseudo register that indicates a memory
-                # location.
-                offset = registers["ptr"] + registers["c"]
-                source_value = memory.peek_from(offset, 1)
-                source_value = int.from_bytes(source_value, "little")
-        else:
+    def execute(self, registers, memory, output):
+        if self.source == 0:
             source_value = self.immediate
+        elif self.source != PTR_C:
+            source_value = registers[self.source]
+        else:
+            offset = registers[PTR] + registers[C]
+            source_value = memory.peek_from(offset, 1)
+            source_value = int.from_bytes(source_value, "little")
 
-        if destination != 7:
-            registers[number_to_register[destination]] = source_value
+        if self.destination != PTR_C:
+            registers[self.destination] = source_value
         else:
-            # "ptr+c" is a pseudo register that indicates a memory
-            # location.
-            offset = registers["ptr"] + registers["c"]
+            offset = registers[PTR] + registers[C]
             memory.write_at(offset, 1, source_value)
 
-class MV32Handler:
+    # NOTE: "data" and "write_at" are the memory's data and "write_at" method.
+    def translate(self, address, next_address):
+        if self.source == 0:
+            source_value = "%d" % self.immediate
+        elif self.source != PTR_C:
+            source_value = register_names[self.source]
+        else:
+            source_value = "data[ptr + c]"
+
+        if self.destination != PTR_C:
+            return ["%s = %s" % (register_names[self.destination], source_value)]
+
+        return ["write_at(ptr + c, 1, %s)" % source_value, "pc = %d" % next_address]
+
+class MV32Handler(Handler):
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
 
-        # A zero "source" indicates a MVI32 instruction instead of
-        # a MV32 one, so, we need to read the immediate payload.
+        destination = (self.opcode & 0b00111000) >> 3
         source = (self.opcode & 0b00000111)
 
-        if source == 0:
-            self.immediate = memory.read(4)
-            self.immediate = int.from_bytes(self.immediate, "little")
+        if not (1 <= destination <= 6) or source == 7:
+            raise ValueError("Invalid MV32 register in opcode 0x%02X" % self.opcode)
 
-    def execute(self, registers, memory, output):
-        number_to_register = { 1: "la", 2: "lb", 3: "lc", 4: "ld",
-                               5: "ptr", 6: "pc" }
+        # Turn register numbers into the register file's indices (see
+        # "vm_registers").
+        self.destination = destination + mv32_register_offset
+        self.source = source + mv32_register_offset if source != 0 else 0
 
-        destination = (self.opcode & 0b00111000) >> 3
+        self.ends_block = (self.destination == PC)
 
-        source = (self.opcode & 0b00000111)
-        source_value = None
+        # A zero "source" indicates a MVI32 instruction instead of
+        # a MV32 one, so, we need to read the immediate payload.
+        if self.source == 0:
+            self.immediate = memory.read(4)
+            self.immediate = int.from_bytes(self.immediate, "little")
+
+    @property
+    def mnemonic(self):
+        return "MVI32" if self.source == 0 else "MV32"
 
-        if source != 0:
-            source_value = registers[number_to_register[source]]
+    def execute(self, registers, memory, output):
+        if self.source == 0:
+            registers[self.destination] = self.immediate
         else:
-            source_value = self.immediate
+            registers[self.destination] = registers[self.source]
+
+    def translate(self, address, next_address):
+        if self.source == 0:
+            source_value = "%d" % self.immediate
+        elif self.source == PC:
+            # The program counter already points to the next instruction.
+            source_value = "%d" % next_address
+        else:
+            source_value = register_names[self.source]
 
-        registers[number_to_register[destination]] = source_value
+        return ["%s = %s" % (register_names[self.destination], source_value)]
 
-class OUTHandler:
+class OUTHandler(Handler):
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
 
     def execute(self, registers, memory, output):
-        output.append(registers["a"])
+        output.append(registers[A])
+
+    # NOTE: "append" is the output's "append" method.
+    def translate(self, address, next_address):
+        return ["append(a)"]
 
-class SUBHandler:
+class SUBHandler(Handler):
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
 
     def execute(self, registers, memory, output):
-        registers["a"] -= registers["b"]
+        registers[A] -= registers[B]
 
-        if registers["a"] < 0:
-            registers["a"] += 255
+        # NOTE: The specification says 255 (not 256) must be added if the
+        # result is negative, as the opposite of ADD.
+        if registers[A] < 0:
+            registers[A] += 255
 
-class XORHandler:
+    def translate(self, address, next_address):
+        return ["a = a - b if a >= b else a - b + 255"]
+
+class XORHandler(Handler):
     def load(self, memory):
         self.opcode = memory.read(1)
         self.opcode = int.from_bytes(self.opcode, "little")
 
     def execute(self, registers, memory, output):
-        registers["a"] ^= registers["b"]
+        registers[A] ^= registers[B]
+
+    def translate(self, address, next_address):
+        return ["a ^= b"]
+
+# Maps every possible opcode into the handler class that can load and
+# execute it. MV and MV32 instructions (and their immediate variants) are
+# identified by their first two bits only ("01" and "10"), so they take
+# up 64 opcodes each. Unknown opcodes are mapped to "None".
+dispatch_table = [None] * 256
+
+for opcode in range(0b01000000, 0b10000000):
+    dispatch_table[opcode] = MVHandler
+
+for opcode in range(0b10000000, 0b11000000):
+    dispatch_table[opcode] = MV32Handler
+
+for opcode, handler_class in { 0x01: HALTHandler, 0x02: OUTHandler, 0x21: JEZHandler,
+                               0x22: JNZHandler, 0xC1: CMPHandler, 0xC2: ADDHandler,
+                               0xC3: SUBHandler, 0xC4: XORHandler, 0xE1: APTRHandler }.items():
+    dispatch_table[opcode] = handler_class
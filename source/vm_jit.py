@@ -0,0 +1,58 @@
+from vm_registers import *
+
+# Basic blocks longer than this are split, to keep compiled functions small.
+max_block_length = 256
+
+# Registers held in local variables by compiled blocks (every register but
+# the program counter, which is kept in "pc").
+_block_registers = ", ".join(register_names[A : PC])
+
+# Compiles the basic block starting at "address" into a Python function,
+# stores it in the memory's cache of compiled blocks and returns it.
+#
+# A basic block runs until an instruction that changes the program counter
+# (JEZ, JNZ, HALT or MV32 into "pc") or writes into memory (which might
+# modify the code that follows). The compiled function takes the register
+# file, the memory and the output, just like handlers do, and returns the
+# address of the next block, or "None" if the VM must halt.
+def compile_block(vm, address: int):
+    start = address
+    lines = []
+    halts = False
+
+    for _ in range(max_block_length):
+        handler, length = vm.memory.decoded.get(address) or vm.decode(address)
+        next_address = address + length
+
+        lines += handler.translate(address, next_address)
+        address = next_address
+
+        if handler.ends_block:
+            halts = handler.halts
+            break
+    else:
+        lines.append("pc = %d" % address)
+
+    source = ["def block(registers, memory, output):",
+              "    %s = registers[%d : %d]" % (_block_registers, A, PC),
+              "    append = output.append",
+              "    data = memory.data",
+              "    write_at = memory.write_at"]
+
+    # Blocks that jump back to their own start (tight loops) keep running
+    # without returning to the VM. Nothing in a block can modify its own
+    # code, as memory writes always end blocks.
+    if halts:
+        source += ["    " + line for line in lines]
+    else:
+        source.append("    while True:")
+        source += ["        " + line for line in lines]
+        source.append("        if pc != %d: break" % start)
+
+    source += ["    registers[%d : %d] = %s, pc" % (A, PC + 1, _block_registers),
+               "    return %s" % ("None" if halts else "pc")]
+
+    namespace = {}
+    exec(compile("\n".join(source), "<block 0x%08X>" % start, "exec"), namespace)
+
+    return vm.memory.cache_block(start, address, namespace["block"])
@@ -1,18 +1,178 @@
+import zlib
+
+from vm_registers import *
+
+# Length (in bytes) of the longest instructions (MVI32, JEZ and JNZ).
+max_instruction_length = 5
+
+# Length (in bytes) of the pages copied by "CopyOnWriteData" on writes.
+page_length = 4096
+
+# Memory that reads from a shared, read-only base image (such as "bytes", an
+# "mmap" or a "memoryview") and copies each page of it only the first time
+# that page is written, so several VMs can run the same image while their
+# memory grows with the pages they write rather than with the image.
+#
+# Supports the same indexing as a "bytearray" of the same length (besides
+# slicing with steps), so it can be used wherever VMs expect one.
+class CopyOnWriteData:
+    def __init__(self, base):
+        self.base = base
+        self.length = len(base)
+
+        # Copied pages, by their number.
+        self.pages = {}
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+
+            if step != 1:
+                raise ValueError("Slices with steps are not supported")
+
+            return self.read_range(start, stop)
+
+        if index < 0:
+            index += self.length
+
+        if not (0 <= index < self.length):
+            raise IndexError("Memory index out of range: 0x%08X" % index)
+
+        page = self.pages.get(index // page_length)
+
+        if page is None:
+            return self.base[index]
+
+        return page[index % page_length]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+
+            if step != 1 or stop - start != len(value):
+                raise ValueError("Only same length slices without steps can be assigned")
+
+            for i in range(len(value)):
+                self[start + i] = value[i]
+
+            return
+
+        if index < 0:
+            index += self.length
+
+        if not (0 <= index < self.length):
+            raise IndexError("Memory index out of range: 0x%08X" % index)
+
+        page_number = index // page_length
+        page = self.pages.get(page_number)
+
+        if page is None:
+            page_start = page_number * page_length
+            page = bytearray(self.base[page_start : page_start + page_length])
+            self.pages[page_number] = page
+
+        page[index % page_length] = value
+
+    def __bytes__(self):
+        return self.read_range(0, self.length)
+
+    # Returns the bytes from "start" to "stop" (not included).
+    def read_range(self, start: int, stop: int):
+        if stop <= start:
+            return b""
+
+        first_page = start // page_length
+        last_page = (stop - 1) // page_length
+
+        # Most reads are a few bytes long and fall in a single page.
+        if first_page == last_page:
+            page = self.pages.get(first_page)
+
+            if page is None:
+                return bytes(self.base[start : stop])
+
+            page_start = first_page * page_length
+            return bytes(page[start - page_start : stop - page_start])
+
+        byte_result = bytearray()
+
+        for page_number in range(first_page, last_page + 1):
+            page_start = page_number * page_length
+            page_stop = page_start + page_length
+            page = self.pages.get(page_number)
+
+            chunk_start = max(start, page_start)
+            chunk_stop = min(stop, page_stop)
+
+            if page is None:
+                byte_result += self.base[chunk_start : chunk_stop]
+            else:
+                byte_result += page[chunk_start - page_start : chunk_stop - page_start]
+
+        return bytes(byte_result)
+
+    # Number of bytes copied from the base image.
+    @property
+    def dirty_length(self):
+        return len(self.pages) * page_length
+
 class VMMemory:
+    # "data" is usually a "bytearray" or a "CopyOnWriteData".
     def __init__(self, registers, data):
         self.registers = registers
         self.data = data
+        self.length = len(data)
+
+        # Numbers of the pages (see "page_length") written since the image
+        # was loaded, so snapshots only need to store those (see
+        # "VM.snapshot"). Pages already copied by a "CopyOnWriteData" (e.g.
+        # patched before running, see "run_patched") count as written.
+        self.dirty_pages = set(data.pages) if isinstance(data, CopyOnWriteData) else set()
+
+        # Last result of "get_clean_digest", as a (number of written pages,
+        # CRC-32) tuple. Pages are never "unwritten", so it's still valid
+        # while that number doesn't change.
+        self.clean_digest = None
+
+        # Instructions already decoded, as (handler, length) tuples by their
+        # address, and the range of addresses they take up.
+        self.decoded = {}
+        self.code_start = len(data)
+        self.code_end = 0
+
+        # Length of the longest decoded instruction, which may be longer
+        # than any single instruction if it's a superinstruction (see
+        # "vm_peephole").
+        self.longest_instruction = max_instruction_length
+
+        # Compiled basic blocks by their address (see "vm_jit"), where each
+        # of them ends, and the addresses of the blocks that include each
+        # byte.
+        self.blocks = {}
+        self.block_ends = {}
+        self.block_owners = {}
 
     # Returns a byte stream read from the current program
     # counter position, without advancing it.
     def peek(self, size: int):
-        result = self.data[self.registers["pc"] : self.registers["pc"] + size]
+        result = self.data[self.registers[PC] : self.registers[PC] + size]
 
         return result
 
+    # Raises an "IndexError" if the given range is not entirely in memory.
+    def check_bounds(self, offset: int, size: int):
+        if offset < 0 or offset + size > self.length:
+            raise IndexError("Memory access out of bounds: %d byte(s) at 0x%08X (memory is %d bytes long)"
+                             % (size, offset, self.length))
+
     # Reads a byte stream from the specified offset, but
     # does not modify the program counter in any way.
     def peek_from(self, offset: int, size: int):
+        self.check_bounds(offset, size)
+
         result = self.data[offset : offset + size]
 
         return result
@@ -20,17 +180,114 @@ class VMMemory:
     # Replaces one or more bytes at the specified offset,
     # without affecting the program counter.
     def write_at(self, offset: int, size: int, value):
+        self.check_bounds(offset, size)
+
         if size == 1:
             self.data[offset] = value
         else:
             for i in range(0, size, 1):
                 self.data[offset + i] = value[i]
 
+        self.dirty_pages.add(offset // page_length)
+
+        if size > 1:
+            self.dirty_pages.update(range(offset // page_length + 1, (offset + size - 1) // page_length + 1))
+
+        # Self-modifying programs must not run outdated instructions.
+        if offset < self.code_end and offset + size > self.code_start:
+            self.invalidate(offset, size)
+
+    # Returns the CRC-32 of every page but the "excluded_pages" (by default,
+    # the written ones), which tells snapshots of different images apart
+    # (see "VM.snapshot"). Pages that haven't been written are still the
+    # same as in the image, and they're the ones snapshots don't store.
+    #
+    # NOTE: It's only computed when needed (and reused while no other page
+    # is written), so VMs that never take snapshots don't pay for it.
+    def get_clean_digest(self, excluded_pages = None):
+        if excluded_pages is None:
+            if self.clean_digest is not None and self.clean_digest[0] == len(self.dirty_pages):
+                return self.clean_digest[1]
+
+            digest = self.get_clean_digest(self.dirty_pages)
+            self.clean_digest = (len(self.dirty_pages), digest)
+
+            return digest
+
+        page_count = -(-self.length // page_length)
+
+        digest = 0
+        start = 0
+
+        # Pages that haven't been written are read from the image directly.
+        with memoryview(self.data.base if isinstance(self.data, CopyOnWriteData) else self.data) as data:
+            for page_number in sorted(excluded_pages) + [page_count]:
+                stop = min(page_number * page_length, self.length)
+
+                if start < stop:
+                    digest = zlib.crc32(data[start : stop], digest)
+
+                start = (page_number + 1) * page_length
+
+        return digest
+
     # Returns one or more bytes starting from the program
     # counter, and then increases the program counter by
     # the amount of bytes read.
     def read(self, size: int):
-        result = self.data[self.registers["pc"] : self.registers["pc"] + size]
-        self.registers["pc"] += size
+        self.check_bounds(self.registers[PC], size)
+
+        result = self.data[self.registers[PC] : self.registers[PC] + size]
+        self.registers[PC] += size
 
         return result
+
+    # Stores a decoded instruction, and returns it.
+    def cache_instruction(self, address: int, handler, length: int):
+        instruction = (handler, length)
+        self.decoded[address] = instruction
+
+        self.code_start = min(self.code_start, address)
+        self.code_end = max(self.code_end, address + length)
+        self.longest_instruction = max(self.longest_instruction, length)
+
+        return instruction
+
+    # Stores a compiled basic block that spans from "start" to "end" (not
+    # included), and returns it.
+    def cache_block(self, start: int, end: int, block):
+        if start in self.blocks:
+            self.forget_block(start)
+
+        self.blocks[start] = block
+        self.block_ends[start] = end
+
+        for address in range(start, end):
+            self.block_owners.setdefault(address, set()).add(start)
+
+        return block
+
+    # Forgets the compiled block at "start", and that it includes any byte.
+    def forget_block(self, start: int):
+        del self.blocks[start]
+
+        for address in range(start, self.block_ends.pop(start)):
+            owners = self.block_owners[address]
+            owners.discard(start)
+
+            if len(owners) == 0:
+                del self.block_owners[address]
+
+    # Forgets the decoded instructions and compiled blocks that include any
+    # of the bytes in the given range.
+    def invalidate(self, offset: int, size: int):
+        start = max(offset - self.longest_instruction + 1, self.code_start)
+        end = min(offset + size, self.code_end)
+
+        for address in range(start, end):
+            self.decoded.pop(address, None)
+
+        if len(self.blocks) != 0:
+            for address in range(offset, offset + size):
+                for block_start in list(self.block_owners.get(address, ())):
+                    self.forget_block(block_start)
@@ -0,0 +1,147 @@
+import re
+import vm_disassembler
+
+from vm_handlers import *
+from vm_registers import *
+
+# Instruction sequences fused into superinstructions, by mnemonic. Longer
+# sequences are tried first.
+superinstruction_patterns = sorted([
+    ("MVI", "MVI", "ADD", "OUT"),
+    ("MVI", "MVI", "SUB", "OUT"),
+    ("MVI", "MVI", "XOR", "OUT"),
+    ("MVI", "MVI", "ADD"),
+    ("MVI", "MVI", "SUB"),
+    ("MVI", "MVI", "XOR"),
+    ("MVI", "ADD", "OUT"),
+    ("MVI", "SUB", "OUT"),
+    ("MVI", "XOR", "OUT"),
+    ("MV", "MVI", "SUB"),
+    ("MVI", "OUT"),
+    ("MV", "OUT"),
+    ("MVI", "CMP", "JEZ"),
+    ("MVI", "CMP", "JNZ"),
+    ("CMP", "JEZ"),
+    ("CMP", "JNZ"),
+], key = len, reverse = True)
+
+_register_pattern = re.compile(r"\b(%s)\b" % "|".join(register_names[A : PC]))
+
+# Matches the variable assigned by a line (e.g. "a" in "a ^= b").
+_assignment_pattern = re.compile(r"^(\w+) \S?= ")
+
+# Generated "execute" functions by their source code, as programs often
+# repeat the same sequences (and compiling them is far slower than running
+# them).
+_compiled_functions = {}
+
+# Runs several instructions in a single dispatch. Its "execute" method is
+# generated from the instructions' translations (see "vm_jit"), loading
+# only the registers they use and storing only the ones they assign.
+#
+# Only the last instruction may end a basic block (a jump), so no
+# instruction can modify the ones that follow it.
+class FusedHandler(Handler):
+    def __init__(self, instructions):
+        self.instructions = instructions
+        self.ends_block = instructions[-1].handler.ends_block
+
+        lines = self.translate(instructions[0].address, instructions[-1].address + instructions[-1].length)
+        body = "\n".join(lines)
+
+        used = sorted(set(_register_pattern.findall(body)), key = register_names.index)
+        assigned = {match.group(1) for match in map(_assignment_pattern.match, lines) if match is not None}
+        assigned = [name for name in used if name in assigned]
+
+        source = ["def execute(registers, memory, output):"]
+        source += ["    %s = registers[%d]" % (name, register_names.index(name)) for name in used]
+
+        if "append(" in body:
+            source.append("    append = output.append")
+
+        if "data[" in body:
+            source.append("    data = memory.data")
+
+        source += ["    " + line for line in lines]
+        source += ["    registers[%d] = %s" % (register_names.index(name), name) for name in assigned]
+
+        if self.ends_block:
+            source.append("    registers[%d] = pc" % PC)
+
+        source = "\n".join(source)
+        function = _compiled_functions.get(source)
+
+        if function is None:
+            namespace = {}
+            exec(compile(source, "<%s>" % self.mnemonic, "exec"), namespace)
+
+            function = _compiled_functions[source] = namespace["execute"]
+
+        self.execute = function
+
+    @property
+    def mnemonic(self):
+        return "+".join(instruction.handler.mnemonic for instruction in self.instructions)
+
+    def translate(self, address, next_address):
+        lines = []
+
+        for instruction in self.instructions:
+            lines += instruction.handler.translate(instruction.address, instruction.address + instruction.length)
+
+        return lines
+
+# Whether "instruction" can be part of a superinstruction (other than as
+# its last instruction, which may also be a jump).
+def _is_fusable(instruction, last: bool):
+    handler = instruction.handler
+
+    if handler is None or handler.halts:
+        return False
+
+    if last and isinstance(handler, (JEZHandler, JNZHandler)):
+        return True
+
+    return not handler.ends_block
+
+# Returns the superinstructions for the instructions of a basic block, as
+# lists of instructions.
+def find_superinstructions(instructions):
+    mnemonics = tuple(instruction.handler.mnemonic if instruction.handler is not None else None
+                      for instruction in instructions)
+
+    result = []
+    i = 0
+
+    while i < len(instructions):
+        for pattern in superinstruction_patterns:
+            candidates = instructions[i : i + len(pattern)]
+
+            if mnemonics[i : i + len(pattern)] == pattern \
+                    and all(_is_fusable(instruction, j == len(pattern) - 1) for j, instruction in enumerate(candidates)):
+                result.append(candidates)
+                i += len(pattern)
+                break
+        else:
+            i += 1
+
+    return result
+
+# Fuses the instructions of the code reachable from the VM's program
+# counter into superinstructions, which replace the first instruction of
+# each sequence in the VM's cache of decoded instructions. Returns the
+# number of superinstructions.
+#
+# Jumping into the middle of a superinstruction runs the original
+# instructions, and writing into one forgets it, like any other decoded
+# instruction, so the program's behaviour doesn't change.
+def optimize(machine):
+    count = 0
+
+    for block in vm_disassembler.build_cfg(machine).values():
+        for instructions in find_superinstructions(block.instructions):
+            length = sum(instruction.length for instruction in instructions)
+            machine.memory.cache_instruction(instructions[0].address, FusedHandler(instructions), length)
+            count += 1
+
+    return count
@@ -0,0 +1,188 @@
+import argparse
+import collections
+import json
+import sys
+import time
+import vm
+
+from vm_registers import *
+
+# Collects execution statistics of the VMs it's attached to (see "VM.run"),
+# which then run through "Profiler.run" instead of their usual loop, so VMs
+# without a profiler don't pay anything for it. Profiled VMs are always
+# interpreted, even if their JIT is enabled, as compiled blocks can't be
+# observed one instruction at a time.
+#
+# If "trace_length" isn't zero, the last "trace_length" executed
+# instructions are kept. "callback", if given, is called with the profiler
+# every time a profiled run ends.
+class Profiler:
+    def __init__(self, trace_length: int = 0, callback = None):
+        # Execution counts by (address, handler), so instructions at the same
+        # address that get overwritten are counted separately.
+        self.counts = {}
+
+        # Execution counts by (source, destination) addresses of every jump
+        # between basic blocks (see "Handler.ends_block").
+        self.edges = {}
+
+        self.trace = collections.deque(maxlen = trace_length) if trace_length != 0 else None
+        self.callback = callback
+        self.elapsed = 0.0
+
+    def run(self, machine, output: bytearray):
+        registers = machine.registers
+        memory = machine.memory
+        decoded = memory.decoded
+
+        counts = self.counts
+        edges = self.edges
+        trace = self.trace
+
+        start = time.perf_counter()
+
+        while True:
+            pc = registers[PC]
+            instruction = decoded.get(pc)
+
+            if instruction is None:
+                instruction = machine.decode(pc)
+
+            handler, length = instruction
+
+            key = (pc, handler)
+            counts[key] = counts.get(key, 0) + 1
+
+            if trace is not None:
+                trace.append(key)
+
+            if handler.halts:
+                break
+
+            registers[PC] = pc + length
+            handler.execute(registers, memory, output)
+
+            if handler.ends_block:
+                edge = (pc, registers[PC])
+                edges[edge] = edges.get(edge, 0) + 1
+
+        self.elapsed += time.perf_counter() - start
+
+        if self.callback is not None:
+            self.callback(self)
+
+    @property
+    def instruction_count(self):
+        return sum(self.counts.values())
+
+    @property
+    def instructions_per_second(self):
+        return self.instruction_count / self.elapsed if self.elapsed != 0.0 else 0.0
+
+    # Execution counts by mnemonic (e.g. "MVI").
+    def opcode_counts(self):
+        result = collections.Counter()
+
+        for (_, handler), count in self.counts.items():
+            result[handler.mnemonic] += count
+
+        return dict(result)
+
+    # Execution counts by address.
+    def pc_counts(self):
+        result = collections.Counter()
+
+        for (pc, _), count in self.counts.items():
+            result[pc] += count
+
+        return dict(result)
+
+    # Returns the "limit" most executed addresses, as (address, count) tuples.
+    def hot_pcs(self, limit: int = 10):
+        return collections.Counter(self.pc_counts()).most_common(limit)
+
+    # Returns the "limit" loops that executed the most instructions. Loops
+    # are found through backward jumps, and span from the jump's destination
+    # to the jump itself.
+    def hot_loops(self, limit: int = 10):
+        pc_counts = self.pc_counts()
+        loops = []
+
+        for (source, destination), iterations in self.edges.items():
+            if destination > source:
+                continue
+
+            instructions = sum(count for pc, count in pc_counts.items() if destination <= pc <= source)
+
+            loops.append({
+                "start": destination,
+                "end": source,
+                "iterations": iterations,
+                "instructions": instructions,
+            })
+
+        loops.sort(key = lambda loop: loop["instructions"], reverse = True)
+
+        return loops[ : limit]
+
+    # Returns the traced instructions, oldest first, as (address, mnemonic)
+    # tuples.
+    def trace_entries(self):
+        if self.trace is None:
+            return []
+
+        return [(pc, handler.mnemonic) for pc, handler in self.trace]
+
+    # Returns every statistic in a JSON serializable dictionary.
+    def report(self, limit: int = 10):
+        return {
+            "instructions": self.instruction_count,
+            "elapsed": self.elapsed,
+            "instructions_per_second": self.instructions_per_second,
+            "opcodes": self.opcode_counts(),
+            "hot_pcs": [{"pc": pc, "count": count} for pc, count in self.hot_pcs(limit)],
+            "edges": [{"source": source, "destination": destination, "count": count}
+                      for (source, destination), count in self.edges.items()],
+            "hot_loops": self.hot_loops(limit),
+            "trace": [{"pc": pc, "mnemonic": mnemonic} for pc, mnemonic in self.trace_entries()],
+        }
+
+    def to_json(self, limit: int = 10, **arguments):
+        return json.dumps(self.report(limit), **arguments)
+
+def print_report(profiler, limit: int = 10, file = sys.stdout):
+    print("%d instructions in %.3f s (%.0f instructions/s)"
+          % (profiler.instruction_count, profiler.elapsed, profiler.instructions_per_second), file = file)
+
+    print("\nOpcodes:", file = file)
+
+    for mnemonic, count in collections.Counter(profiler.opcode_counts()).most_common():
+        print("  %-6s %12d" % (mnemonic, count), file = file)
+
+    print("\nHot loops:", file = file)
+
+    for loop in profiler.hot_loops(limit):
+        print("  0x%08X-0x%08X %12d instructions, %d iterations"
+              % (loop["start"], loop["end"], loop["instructions"], loop["iterations"]), file = file)
+
+# Usage: python vm_profiler.py program [--top N] [--json path] [--trace N]
+# Runs a VM program (raw bytecode) and reports where its time goes.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Profile a VM program.")
+    parser.add_argument("program", help = "file with the program's bytecode")
+    parser.add_argument("--top", type = int, default = 10, help = "number of hot loops to list")
+    parser.add_argument("--json", help = "also write the full report into this file")
+    parser.add_argument("--trace", type = int, default = 0, help = "number of instructions to trace")
+
+    arguments = parser.parse_args()
+
+    with open(arguments.program, "rb") as program:
+        profiler = Profiler(arguments.trace)
+        output = vm.VM(bytearray(program.read()), profiler = profiler).run()
+
+    print("%d bytes of output" % len(output))
+    print_report(profiler, arguments.top)
+
+    if arguments.json is not None:
+        with open(arguments.json, "w") as report:
+            report.write(profiler.to_json(arguments.top, indent = 4))
@@ -0,0 +1,43 @@
+import collections.abc
+
+# Index of each register inside the register file, which is a plain list
+# (the fastest container to index by integers in Python).
+#
+# NOTE: MV instructions number the 8-bit registers from 1 ("a") to 6 ("f"),
+# and MV32 instructions the 32-bit ones from 1 ("la") to 6 ("pc"), so the
+# register file keeps that order, placing the 32-bit registers after the
+# 8-bit ones. Index 0 is not used.
+A, B, C, D, E, F = range(1, 7)
+LA, LB, LC, LD, PTR, PC = range(7, 13)
+
+register_names = (None, "a", "b", "c", "d", "e", "f", "la", "lb", "lc", "ld", "ptr", "pc")
+
+# Values written into each register are kept within its width.
+register_masks = (0,) + (0xFF,) * 6 + (0xFFFFFFFF,) * 6
+
+# Offset between the MV32 register numbers and their indices.
+mv32_register_offset = LA - 1
+
+def new_register_file():
+    return [0] * len(register_names)
+
+# Read-only view of a register file, mapping register names into their
+# values. Meant for debugging, since it's slower than the register file.
+class RegisterView(collections.abc.Mapping):
+    def __init__(self, registers):
+        self._registers = registers
+
+    def __getitem__(self, name: str):
+        if name not in register_names or name is None:
+            raise KeyError(name)
+
+        return self._registers[register_names.index(name)]
+
+    def __iter__(self):
+        return iter(register_names[1 : ])
+
+    def __len__(self):
+        return len(register_names) - 1
+
+    def __repr__(self):
+        return "RegisterView(%r)" % dict(self)
@@ -0,0 +1,42 @@
+# Sample VM programs, used by the tests and benchmarks.
+
+# A loop-heavy VM program: counts "d" down from 255 to 0, "outer" times,
+# and outputs the outer counter on every iteration.
+def countdown_program(outer: int = 200):
+    return bytes([
+        0x68, outer,           # MVI e <- outer
+        0x60, 0xFF,            # MVI d <- 255 (outer loop)
+        0x4C,                  # MV a <- d (inner loop)
+        0x50, 0x01,            # MVI b <- 1
+        0xC3,                  # SUB
+        0x61,                  # MV d <- a
+        0x50, 0x00,            # MVI b <- 0
+        0xC1,                  # CMP
+        0x22, 0x04, 0, 0, 0,   # JNZ 4
+        0x4D,                  # MV a <- e
+        0x02,                  # OUT
+        0x50, 0x01,            # MVI b <- 1
+        0xC3,                  # SUB
+        0x69,                  # MV e <- a
+        0x50, 0x00,            # MVI b <- 0
+        0xC1,                  # CMP
+        0x22, 0x02, 0, 0, 0,   # JNZ 2
+        0x01,                  # HALT
+    ])
+
+# A VM program that outputs "message", every byte of it obfuscated with an
+# XOR between two immediates.
+def message_program(message: bytes, key: int = 0x5A):
+    program = bytearray()
+
+    for byte in message:
+        program += bytes([
+            0x48, byte ^ key,  # MVI a <- byte ^ key
+            0x50, key,         # MVI b <- key
+            0xC4,              # XOR
+            0x02,              # OUT
+        ])
+
+    program.append(0x01) # HALT
+
+    return bytes(program)
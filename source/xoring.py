@@ -1,3 +1,8 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # To obtain the key, I knew that the first 15 bytes of the actual data would be:
 #
 #   "==[ Layer 4/6: "
@@ -33,12 +38,217 @@ key = bytes([108, 36, 132, 142, 66, 25, 168, 225, 197, 219, 87,
              101, 185, 198, 20, 158, 165, 25, 53, 150, 59, 57,
              127, 165, 101, 209, 254, 1, 133, 125, 217, 76])
 
-def decode(byte_data: bytes):
-    byte_result = bytearray()
-    count = 0
+# Amount of bytes (rounded to a multiple of the key length) XORed at once,
+# which bounds the memory used by the tiled key.
+block_length = 1024 * 1024
+
+# XORs the data against a repeating key. "offset" is the key position of the
+# first byte, which allows decoding slices or chunks that start mid-key.
+def xor(byte_data: bytes, key: bytes, offset: int = 0):
+    # Rotate the key so that it starts at the given offset.
+    offset %= len(key)
+    key = bytes(key[offset : ]) + bytes(key[0 : offset])
+
+    # Repeat the key to cover a whole block, so that a block is XORed at
+    # once instead of one byte at a time.
+    key_repetitions = max(1, block_length // len(key))
+    tiled_key = key * key_repetitions
+    length = len(tiled_key)
 
-    for b in byte_data:
-        byte_result.append(b ^ key[count % 32])
-        count += 1
+    byte_result = bytearray(len(byte_data))
+    byte_data = memoryview(byte_data)
+
+    for start in range(0, len(byte_data), length):
+        block = byte_data[start : start + length]
+        size = len(block)
+
+        if numpy is not None:
+            numpy.bitwise_xor(numpy.frombuffer(block, dtype = numpy.uint8),
+                              numpy.frombuffer(tiled_key, dtype = numpy.uint8, count = size),
+                              out = numpy.frombuffer(byte_result, dtype = numpy.uint8)[start : start + size])
+        else:
+            # NOTE: XORing two big integers works at C speed, and big-endian
+            # keeps the leading zero bytes in place.
+            word = int.from_bytes(block, "big") ^ int.from_bytes(tiled_key[0 : size], "big")
+            byte_result[start : start + size] = word.to_bytes(size, "big")
 
     return byte_result
+
+def decode(byte_data: bytes):
+    return xor(byte_data, key)
+
+# Bytes expected in a text payload: printable ASCII characters, tabs and
+# line breaks.
+printable_bytes = bytes(range(32, 127)) + b"\t\n\r"
+
+# The first bytes of the data may be too few to be representative, but
+# taking more than this doesn't change the index of coincidence much.
+key_length_sample_length = 256 * 1024
+
+# Counts how many times each byte appears in every key position (i.e. in
+# every "column" of the data, if split in rows of "key_length" bytes).
+def _count_columns(byte_data: bytes, key_length: int):
+    if numpy is not None:
+        data = numpy.frombuffer(byte_data, dtype = numpy.uint8).astype(numpy.int64)
+        positions = numpy.arange(len(data), dtype = numpy.int64) % key_length
+
+        counts = numpy.bincount(positions * 256 + data, minlength = key_length * 256)
+
+        return counts.reshape(key_length, 256)
+
+    counts = []
+
+    for position in range(key_length):
+        column = byte_data[position : : key_length]
+        counts.append([column.count(bytes([b])) for b in range(256)])
+
+    return counts
+
+# Guesses the length of the key used to XOR a payload, using the index of
+# coincidence: when splitting the data in columns of the right length, each
+# column is XORed against the same key byte, so its byte distribution is as
+# uneven as the plain text's.
+def guess_key_length(byte_data: bytes, max_key_length: int = 256):
+    byte_data = bytes(byte_data[0 : key_length_sample_length])
+    coincidences = []
+
+    for key_length in range(1, max_key_length + 1):
+        counts = _count_columns(byte_data, key_length)
+
+        if numpy is not None:
+            lengths = counts.sum(axis = 1)
+            pairs = (counts * (counts - 1)).sum(axis = 1)
+            index = (pairs / numpy.maximum(lengths * (lengths - 1), 1)).mean()
+        else:
+            index = 0
+
+            for column_counts in counts:
+                length = sum(column_counts)
+                pairs = sum(count * (count - 1) for count in column_counts)
+                index += pairs / max(length * (length - 1), 1)
+
+            index /= key_length
+
+        coincidences.append(float(index))
+
+    # NOTE: Multiples of the key length are as good as the key length
+    # itself, so the shortest length that is almost as good as the best
+    # one is chosen.
+    best = max(coincidences)
+
+    for key_length, index in enumerate(coincidences, 1):
+        if index >= 0.9 * best:
+            return key_length
+
+# How much each byte looks like text, used to tell apart key bytes which
+# yield printable bytes only: letters and spaces (the most common bytes in
+# text) are worth more than the rest of the printable bytes.
+text_byte_weights = [2 if chr(b).isalpha() or b == 32 else 1 if b in printable_bytes else 0
+                     for b in range(256)]
+
+# Scores every possible byte of every key position by the average weight of
+# the bytes in its column after XORing them with it. "weights" defaults to
+# "text_byte_weights".
+def _score_key_bytes(byte_data: bytes, key_length: int, weights = None):
+    if weights is None:
+        weights = text_byte_weights
+
+    counts = _count_columns(byte_data, key_length)
+
+    if numpy is not None:
+        # Row "k" holds the weight of every byte after XORing it with "k".
+        xor_weights = numpy.array([[weights[b ^ k] for b in range(256)] for k in range(256)])
+
+        lengths = numpy.maximum(counts.sum(axis = 1), 1)
+
+        return (counts @ xor_weights.T) / lengths[:, numpy.newaxis]
+
+    scores = []
+
+    for column_counts in counts:
+        length = max(sum(column_counts), 1)
+        present = [(b, count) for b, count in enumerate(column_counts) if count != 0]
+
+        scores.append([sum(count * weights[b ^ k] for b, count in present) / length
+                       for k in range(256)])
+
+    return scores
+
+# Finds where "crib" (a known piece of plain text) most likely is, by XORing
+# it at every offset to get candidate key bytes and adding up their scores.
+# Returns the key bytes implied by the best offset, by key position, and the
+# score of that offset per crib byte (so that cribs of different lengths
+# can be compared).
+def _place_crib(byte_data: bytes, crib: bytes, key_length: int, scores):
+    offset_count = len(byte_data) - len(crib) + 1
+
+    if offset_count <= 0:
+        return {}, 0.0
+
+    if numpy is not None:
+        data = numpy.frombuffer(byte_data, dtype = numpy.uint8)
+        offsets = numpy.arange(offset_count)
+        offset_scores = numpy.zeros(offset_count)
+
+        # Slide the whole crib at once, one crib character at a time.
+        for j, c in enumerate(crib):
+            key_bytes = data[j : j + offset_count] ^ c
+            offset_scores += scores[(offsets + j) % key_length, key_bytes]
+
+        best_offset = int(offset_scores.argmax())
+        best_score = float(offset_scores[best_offset])
+    else:
+        best_offset, best_score = 0, -1
+
+        for offset in range(offset_count):
+            score = sum(scores[(offset + j) % key_length][byte_data[offset + j] ^ c]
+                        for j, c in enumerate(crib))
+
+            if score > best_score:
+                best_offset, best_score = offset, score
+
+    key_bytes = {(best_offset + j) % key_length: byte_data[best_offset + j] ^ c
+                 for j, c in enumerate(crib)}
+
+    return key_bytes, best_score / len(crib)
+
+# Recovers the key used to XOR a text payload, automating what's described
+# at the top of this file. Every crib is placed where it most likely is, and
+# the key positions that no crib covers get the byte which makes their
+# column look the most like text. Returns the key and, for each of its
+# bytes, the ratio of printable bytes it yields (its confidence).
+def recover_key(byte_data: bytes, cribs = (), key_length: int = None):
+    byte_data = bytes(byte_data)
+
+    if key_length is None:
+        key_length = guess_key_length(byte_data)
+
+    scores = _score_key_bytes(byte_data, key_length)
+
+    # Start with the best byte for each column on its own.
+    key = bytearray(max(range(256), key = lambda k: scores[p][k]) for p in range(key_length))
+
+    # Bytes found using cribs win over the rest, as known plain text is more
+    # reliable than statistics (especially on short payloads). If several
+    # cribs cover the same key position, the one placed with the best score
+    # per byte wins.
+    crib_key_bytes = {}
+
+    for crib in cribs:
+        key_bytes, placement_score = _place_crib(byte_data, crib, key_length, scores)
+
+        for position, key_byte in key_bytes.items():
+            current = crib_key_bytes.get(position)
+
+            if current is None or placement_score > current[1]:
+                crib_key_bytes[position] = (key_byte, placement_score)
+
+    for position, (key_byte, _) in crib_key_bytes.items():
+        key[position] = key_byte
+
+    is_printable = [1 if b in printable_bytes else 0 for b in range(256)]
+    printable_ratios = _score_key_bytes(byte_data, key_length, is_printable)
+
+    confidences = [float(printable_ratios[p][key[p]]) for p in range(key_length)]
+
+    return bytes(key), confidences